@@ -0,0 +1,367 @@
+#! python
+import os, sys, time
+import threading
+import argparse, json
+import subprocess
+import shutil, tempfile
+import socket, shlex
+import paramiko
+try:
+    import resource
+except ImportError:
+    resource = None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nanoscp import Log, app_core
+
+
+# Write synthetic reads at a fixed rate, MinKNOW style into numbered sub directories
+class ReadGenerator():
+    def __init__(self, path, rate=100, size=200000, reads_per_dir=4000, chunks=4):
+        self.path = path
+        self.rate = rate
+        self.size = size
+        self.reads_per_dir = reads_per_dir
+        self.chunks = chunks
+        self.close_times = {}
+        self.__block = os.urandom(size * 2)
+        self.__stop_event = threading.Event()
+        self.__worker = None
+
+    def read_name(self, i):
+        return os.path.join(self.path, str(i // self.reads_per_dir), 'read_{:09d}.fast5'.format(i))
+
+    # write file in chunks like a growing fast5, data is incompressible
+    def write_read(self, i):
+        name = self.read_name(i)
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        offset = (i * 7919) % self.size
+        data = memoryview(self.__block)[offset:offset + self.size]
+        chunk = max(1, self.size // self.chunks)
+        with open(name, 'wb') as fp:
+            for pos in range(0, self.size, chunk):
+                fp.write(data[pos:pos + chunk])
+                fp.flush()
+        self.close_times[os.path.basename(name)] = time.time()
+
+    # write n reads as fast as possible, empty files if size is 0
+    # backdated a day, so the scan archives them without waiting for them to settle
+    def populate(self, n):
+        t_old = time.time() - 86400
+        for i in range(n):
+            name = self.read_name(i)
+            if self.size:
+                self.write_read(i)
+            else:
+                if i % self.reads_per_dir == 0:
+                    os.makedirs(os.path.dirname(name), exist_ok=True)
+                open(name, 'wb').close()
+            os.utime(name, (t_old, t_old))
+
+    def start(self):
+        self.__stop_event.clear()
+        self.__worker = threading.Thread(target=self.__generator__)
+        self.__worker.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__worker.join()
+
+    def __generator__(self):
+        i = 0
+        t_next = time.time()
+        while not self.__stop_event.is_set():
+            self.write_read(i)
+            i += 1
+            t_next += 1.0 / self.rate
+            self.__stop_event.wait(max(0, t_next - time.time()))
+
+
+# Local SSH/ SFTP server stand-in serving a directory, supports sha256sum exec
+class SFTPStandIn():
+    def __init__(self, root):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.__socket = socket.socket()
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__socket.bind(('127.0.0.1', 0))
+        self.__socket.listen(16)
+        self.port = self.__socket.getsockname()[1]
+        threading.Thread(target=self.__server__, daemon=True).start()
+
+    def close(self):
+        self.__socket.close()
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def __server__(self):
+        stand_in = self
+
+        class Server(paramiko.ServerInterface):
+            def get_allowed_auths(self, username):
+                return 'password,publickey'
+
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_auth_publickey(self, username, key):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+
+            def check_channel_exec_request(self, channel, command):
+                args = shlex.split(command.decode())
+                if len(args) != 2 or args[0] != 'sha256sum':
+                    return False
+                def run():
+                    result = subprocess.run(['sha256sum', stand_in.local_path(args[1])], capture_output=True)
+                    channel.sendall(result.stdout)
+                    channel.send_exit_status(result.returncode)
+                    channel.close()
+                threading.Thread(target=run, daemon=True).start()
+                return True
+
+        class Handle(paramiko.SFTPHandle):
+            def stat(self):
+                return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+        class SFTP(paramiko.SFTPServerInterface):
+            def open(self, path, flags, attr):
+                try:
+                    fd = os.open(stand_in.local_path(path), flags, 0o644)
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                if flags & os.O_WRONLY:
+                    mode = 'ab' if flags & os.O_APPEND else 'wb'
+                elif flags & os.O_RDWR:
+                    mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+                else:
+                    mode = 'rb'
+                handle = Handle(flags)
+                handle.readfile = handle.writefile = os.fdopen(fd, mode)
+                return handle
+
+            def stat(self, path):
+                try:
+                    return paramiko.SFTPAttributes.from_stat(os.stat(stand_in.local_path(path)))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+
+            lstat = stat
+
+            def remove(self, path):
+                try:
+                    os.remove(stand_in.local_path(path))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                return paramiko.SFTP_OK
+
+            def rename(self, oldpath, newpath):
+                try:
+                    os.rename(stand_in.local_path(oldpath), stand_in.local_path(newpath))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                return paramiko.SFTP_OK
+
+            def posix_rename(self, oldpath, newpath):
+                try:
+                    os.replace(stand_in.local_path(oldpath), stand_in.local_path(newpath))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                return paramiko.SFTP_OK
+
+        while True:
+            try:
+                client, _ = self.__socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, SFTP)
+            transport.start_server(server=Server())
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'n': len(values), 'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99),
+            'max': values[-1], 'mean': sum(values) / len(values)}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == 'darwin' else rss / 1e3
+
+
+# time from read closed to its batch manifest written in path
+def manifest_latencies(path, close_times):
+    latencies = []
+    for name in os.listdir(path):
+        if not name.endswith('.manifest'):
+            continue
+        manifest = os.path.join(path, name)
+        t_done = os.stat(manifest).st_mtime
+        with open(manifest, 'r') as fp:
+            for line in fp:
+                member = line.split('\t')[0]
+                if member in close_times:
+                    latencies.append(t_done - close_times[member])
+    return latencies
+
+
+def make_app(args, source_path, export_path, log):
+    app = app_core(log=log)
+    app.source_path = source_path
+    app.export_path = export_path
+    app.recursive = True
+    app.batch_size = args.batch_size
+    app.batch_age = args.batch_age
+    app.delay = args.delay
+    app.archive_workers = args.workers
+    app.min_free_mb = 0
+    return app
+
+
+def wait_archived(app, n, timeout):
+    t_end = time.time() + timeout
+    while app.metrics.counter('files_archived_total') < n and time.time() < t_end:
+        time.sleep(0.1)
+
+
+def bench_scan(args, tmp):
+    source_path, export_path = os.path.join(tmp, 'source'), os.path.join(tmp, 'export')
+    os.makedirs(export_path)
+    ReadGenerator(source_path, size=0).populate(args.scan_files)
+    log = Log()
+    app = make_app(args, source_path, export_path, log)
+    app.batch_size = args.scan_files + 1
+    app.batch_age = 0
+    t_start = time.time()
+    app.start_watchdog()
+    app.cells[0].scanner.join()
+    t_scan = time.time() - t_start
+    app.cells[0].archiver.stop(partial_write=False)
+    app.stop_watchdog()
+    return {'files': args.scan_files, 'seconds': t_scan, 'files_per_s': args.scan_files / t_scan}
+
+
+def bench_archive(args, tmp):
+    source_path, export_path = os.path.join(tmp, 'source'), os.path.join(tmp, 'export')
+    os.makedirs(export_path)
+    ReadGenerator(source_path, size=args.size_kb * 1000).populate(args.archive_files)
+    log = Log()
+    app = make_app(args, source_path, export_path, log)
+    t_start = time.time()
+    app.start_watchdog()
+    wait_archived(app, args.archive_files, args.timeout)
+    t_archive = time.time() - t_start
+    app.stop_watchdog()
+    total = app.metrics.counter('bytes_archived_total')
+    return {'files': app.metrics.counter('files_archived_total'), 'bytes': total, 'seconds': t_archive,
+            'mb_per_s': total / 1e6 / t_archive, 'tar_write_p50_s': app.metrics.quantile('tar_write_seconds', 0.5)}
+
+
+def bench_pipeline(args, tmp, upload=False):
+    source_path, export_path = os.path.join(tmp, 'source'), os.path.join(tmp, 'export')
+    remote_path = os.path.join(tmp, 'remote')
+    for path in [source_path, export_path, remote_path]:
+        os.makedirs(path)
+    log = Log()
+    app = make_app(args, source_path, export_path, log)
+    server = None
+    if upload:
+        server = SFTPStandIn(remote_path)
+        app.ssh_host, app.ssh_port, app.ssh_user, app.ssh_pw = '127.0.0.1', server.port, 'bench', 'bench'
+        app.ssh_stream = args.stream
+        app.ssh_verify = args.verify
+        app.ssh_trust_new_host, app.ssh_known_hosts = True, os.path.join(tmp, 'known_hosts')
+    generator = ReadGenerator(source_path, rate=args.rate, size=args.size_kb * 1000)
+    app.start_watchdog()
+    t_start = time.time()
+    generator.start()
+    time.sleep(args.duration)
+    generator.stop()
+    wait_archived(app, len(generator.close_times), args.delay + args.batch_age + args.timeout)
+    app.stop_watchdog()
+    t_total = time.time() - t_start
+    if server:
+        server.close()
+    result = {'generated': len(generator.close_times), 'archived': app.metrics.counter('files_archived_total'),
+              'seconds': t_total, 'read_rate': args.rate, 'read_kb': args.size_kb,
+              'archive_mb_per_s': app.metrics.counter('bytes_archived_total') / 1e6 / t_total,
+              'event_to_archive_s': percentiles(manifest_latencies(export_path, generator.close_times)),
+              'errors': sum(1 for _, _, level, _ in log.entries() if level == 'ERROR')}
+    if upload:
+        result['upload_mb_per_s'] = app.metrics.counter('bytes_uploaded_total') / 1e6 / t_total
+        result['upload_p50_s'] = app.metrics.quantile('upload_seconds', 0.5)
+        result['event_to_upload_s'] = percentiles(manifest_latencies(remote_path, generator.close_times))
+    return result
+
+
+SCENARIOS = {'scan': bench_scan, 'archive': bench_archive, 'pipeline': bench_pipeline,
+             'upload': lambda args, tmp: bench_pipeline(args, tmp, upload=True)}
+
+
+# run one scenario in this process and print its result as JSON
+def run_scenario(args):
+    tmp = tempfile.mkdtemp(prefix='nanoscp_bench_', dir=args.tmp)
+    try:
+        result = SCENARIOS[args.run](args, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the nanoscp watch, batch and ship pipeline')
+    parser.add_argument('--scenarios', default='scan,archive,pipeline,upload',
+                        help='comma separated list of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--scan-files', type=int, default=100000, help='empty files for the initial scan')
+    parser.add_argument('--archive-files', type=int, default=2000, help='existing reads to archive')
+    parser.add_argument('--rate', type=float, default=100, help='generated reads per second')
+    parser.add_argument('--size-kb', type=int, default=200, help='size of generated reads')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to generate reads')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--batch-age', type=int, default=5)
+    parser.add_argument('--delay', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--stream', action='store_true', help='stream batches in the upload scenario')
+    parser.add_argument('--verify', action='store_true', help='verify remote checksums in the upload scenario')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--tmp', default=None, help='directory for temporary source and export trees')
+    parser.add_argument('--output', default=None, help='write JSON results to file')
+    parser.add_argument('--run', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args(argv)
+    if args.run:
+        run_scenario(args)
+        return 0
+    # scenarios in separate processes for independent peak memory
+    argv = sys.argv[1:] if argv is None else argv
+    results = {'time': time.time(), 'python': sys.version.split()[0], 'settings': vars(args), 'results': {}}
+    for scenario in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario ' + scenario)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', scenario] + argv,
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            results['results'][scenario] = {'error': process.stderr.strip().splitlines()[-1:]}
+        else:
+            results['results'][scenario] = json.loads(process.stdout.strip().splitlines()[-1])
+        print(scenario, json.dumps(results['results'][scenario]), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,28 @@
 import os, sys, glob, time
 import threading, queue
 import tarfile
+import hashlib, shlex, base64
+import heapq, bisect
+import collections, itertools
+import posixpath
+import shutil
+import gzip, zlib
+import concurrent.futures, concurrent.futures.process, multiprocessing
 import paramiko, socket
 import re
-import wx
-import wx.lib
-from wx.lib import intctrl
+import sqlite3
+import argparse, configparser
+import signal
+import json
+import http.server
 from watchdog.observers import Observer
 from watchdog.events import RegexMatchingEventHandler
 from watchdog.events import FileMovedEvent
+from watchdog.events import FileCreatedEvent, FileModifiedEvent
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 # Handle file system events matching regex
@@ -19,20 +33,150 @@ class FileHandler(RegexMatchingEventHandler):
         self.notify = notify
         
     def on_any_event(self, event):
+        if event.event_type in ['opened', 'closed_no_write']:
+            return  # reading files e.g. while archiving is no change
         if not event.is_directory and self.notify and not isinstance(event, FileMovedEvent):
             self.notify(event.src_path)
 
 
+# Polling observer for network shares without native file system events
+# only directories with changed mtime are listed again and only new names
+# are stat'ed, recently changed files are checked on each poll until
+# unchanged for settle_time seconds
+class DirectoryPoller():
+    def __init__(self, interval=5, settle_time=60):
+        self.interval = interval
+        self.settle_time = settle_time
+        self.__watches = []
+        self.__stop_event = threading.Event()
+        self.__poll_worker = None
+
+    def schedule(self, event_handler, path, recursive=False):
+        self.__watches.append({'handler': event_handler, 'path': path, 'recursive': recursive,
+                               'dirs': {}, 'files': {}, 'hot': {}})
+
+    def start(self):
+        if not self.__poll_worker:
+            self.__stop_event.clear()
+            self.__poll_worker = threading.Thread(target=self.__poller__)
+            self.__poll_worker.start()
+
+    def stop(self):
+        self.__stop_event.set()
+
+    def join(self):
+        if self.__poll_worker:
+            self.__poll_worker.join()
+            self.__poll_worker = None
+
+    # list directory and diff names against index, emit events for new files
+    def __list_dir__(self, watch, path, emit=True):
+        t_now = time.time()
+        try:
+            watch['dirs'][path] = (os.stat(path).st_mtime_ns, time.time_ns())
+            entries = list(os.scandir(path))
+        except OSError:
+            watch['dirs'].pop(path, None)
+            watch['files'].pop(path, None)
+            return
+        files = watch['files'].setdefault(path, {})
+        names = set()
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if watch['recursive'] and entry.path not in watch['dirs']:
+                        self.__list_dir__(watch, entry.path, emit=emit)
+                    continue
+                names.add(entry.name)
+                # known files are checked through the hot set, one stat per file is a round trip on shares
+                if entry.name in files:
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            if emit:
+                watch['hot'][entry.path] = t_now
+                watch['handler'].dispatch(FileCreatedEvent(entry.path))
+        for name in [name for name in files if name not in names]:
+            del files[name]
+
+    def __poll__(self, watch):
+        t_now = time.time()
+        for path, (mtime, listed) in list(watch['dirs'].items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                watch['dirs'].pop(path, None)
+                watch['files'].pop(path, None)
+                continue
+            # coarse mtime resolution on shares, list again if changed within last listing tick
+            if current != mtime or current >= listed - 2 * 10**9:
+                self.__list_dir__(watch, path)
+        for path, t_change in list(watch['hot'].items()):
+            dir_name, name = os.path.split(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del watch['hot'][path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            files = watch['files'].setdefault(dir_name, {})
+            if files.get(name) != signature:
+                files[name] = signature
+                watch['hot'][path] = t_now
+                watch['handler'].dispatch(FileModifiedEvent(path))
+            elif t_now - t_change > self.settle_time:
+                del watch['hot'][path]
+
+    def __poller__(self):
+        for watch in self.__watches:
+            self.__list_dir__(watch, watch['path'], emit=False)
+        while not self.__stop_event.wait(self.interval):
+            for watch in self.__watches:
+                self.__poll__(watch)
+
+
 # Set with timestamp to retrieve items at least n seconds not touched
+# items are released by a timer thread once their delay expired,
+# notify is called with item and time of the last touch
 class TimedSet():
-    def __init__(self):
+    def __init__(self, delay=0, notify=None):
+        self.delay = delay
+        self.notify = notify
         self.__data = dict()
+        self.__deadlines = []
         self.__condition = threading.Condition()
+        self.__timer = None
+        self.__running = False
+
+    def __len__(self):
+        return len(self.__data)
+
+    def start(self):
+        if not self.__timer:
+            self.__running = True
+            self.__timer = threading.Thread(target=self.__release__)
+            self.__timer.start()
+
+    def stop(self):
+        if self.__timer:
+            with self.__condition:
+                self.__running = False
+                self.__condition.notify_all()
+            self.__timer.join()
+            self.__timer = None
 
     def put(self, item):
+        t_now = time.time()
         with self.__condition:
-            self.__data[item] = time.time()
+            self.__data[item] = t_now
+            deadline = t_now + self.delay
+            heapq.heappush(self.__deadlines, (deadline, item))
+            if self.__deadlines[0][0] == deadline:
+                self.__condition.notify()
 
+    # remove and return all items not touched for t_wait seconds
     def get(self, t_wait=0):
         items = []
         t_now = time.time()
@@ -42,93 +186,1570 @@ class TimedSet():
                 if self.__data[key] + t_wait <= t_now:
                     del self.__data[key]
                     items.append(key)
+            if not self.__data:
+                self.__deadlines.clear()
+        return items
+
+    # pop expired deadlines, stale entries of touched items are skipped
+    def __expired__(self, t_now):
+        items = []
+        while self.__deadlines and self.__deadlines[0][0] <= t_now:
+            deadline, item = heapq.heappop(self.__deadlines)
+            if item in self.__data and self.__data[item] + self.delay == deadline:
+                items.append((item, self.__data.pop(item)))
         return items
 
+    def __release__(self):
+        while True:
+            with self.__condition:
+                while True:
+                    if not self.__running:
+                        return
+                    t_now = time.time()
+                    items = self.__expired__(t_now)
+                    if items:
+                        break
+                    timeout = self.__deadlines[0][0] - t_now if self.__deadlines else None
+                    self.__condition.wait(timeout)
+            if self.notify:
+                for item, t_touch in items:
+                    self.notify(item, t_touch)
+
+
+# Logger, keeps the last capacity messages with sequence number, time and level
+class Log():
+    LEVELS = ['ERROR', 'WARNING', 'INFO']
 
-# Logger
-class Log(list):
-    def __init__(self, **kwargs):
+    def __init__(self, capacity=10000):
         self.callbacks = []
-        return super().__init__(**kwargs)
-        
+        self.__entries = collections.deque(maxlen=capacity)
+        self.__seq = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        return iter([message for _, _, _, message in self.entries()])
+
     def add_callback(self, callback):
         self.callbacks.append(callback)
 
-    def append(self, object):
+    def append(self, object, level=None):
+        message = str(object)
+        if level is None:
+            level = next((l for l in Log.LEVELS if message.startswith('[' + l + ']')), 'INFO')
+        with self.__lock:
+            self.__seq += 1
+            self.__entries.append((self.__seq, time.time(), level, message))
         for callback in self.callbacks:
-            callback(object)
-        return super().append(object)
+            callback(message)
+
+    # entries with sequence number greater than since
+    def entries(self, since=0):
+        with self.__lock:
+            if not self.__entries or self.__entries[-1][0] <= since:
+                return []
+            first = self.__entries[0][0]
+            return list(itertools.islice(self.__entries, max(0, since - first + 1), None))
+
+    @staticmethod
+    def format(entry):
+        _, t, _, message = entry
+        return time.strftime('%H:%M:%S', time.localtime(t)) + ' ' + message
+
+
+# Metrics registry with counters, gauges and latency histograms
+class Metrics():
+    BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+    def __init__(self, prefix='nanoscp_'):
+        self.prefix = prefix
+        self.__counters = {}
+        self.__gauges = {}
+        self.__histograms = {}
+        self.__rates = {}
+        self.__samples = {}
+        self.__lock = threading.Lock()
+        self.__export_worker = None
+        self.__export_stop = threading.Event()
+        self.__http_server = None
+
+    def inc(self, name, value=1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    # set gauge to value or callable evaluated on read
+    def set(self, name, value):
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def observe(self, name, value):
+        with self.__lock:
+            if name not in self.__histograms:
+                self.__histograms[name] = {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(Metrics.BUCKETS) + 1)}
+            histogram = self.__histograms[name]
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['buckets'][bisect.bisect_left(Metrics.BUCKETS, value)] += 1
+
+    def counter(self, name):
+        return self.__counters.get(name, 0)
+
+    def gauge(self, name):
+        value = self.__gauges.get(name, 0)
+        try:
+            return value() if callable(value) else value
+        except Exception:
+            return 0
+
+    # per second rate of counter between the last two samples
+    def rate(self, name):
+        return self.__rates.get(name, 0.0)
+
+    # estimate quantile as upper bound of histogram bucket
+    def quantile(self, name, q):
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if not histogram or not histogram['count']:
+                return 0.0
+            rank = q * histogram['count']
+            total = 0
+            for bound, count in zip(Metrics.BUCKETS + [float('inf')], histogram['buckets']):
+                total += count
+                if total >= rank:
+                    return bound
+        return float('inf')
+
+    def sample(self):
+        t_now = time.time()
+        with self.__lock:
+            for name, value in self.__counters.items():
+                t_last, last = self.__samples.get(name, (t_now, value))
+                if t_now > t_last:
+                    self.__rates[name] = (value - last) / (t_now - t_last)
+                self.__samples[name] = (t_now, value)
+
+    def snapshot(self):
+        with self.__lock:
+            counters = dict(self.__counters)
+            gauges = list(self.__gauges.keys())
+            rates = dict(self.__rates)
+            histograms = {name: {'count': h['count'], 'sum': h['sum'],
+                                 'buckets': dict(zip([str(b) for b in Metrics.BUCKETS] + ['+Inf'],
+                                                     itertools.accumulate(h['buckets'])))}
+                          for name, h in self.__histograms.items()}
+        return {'time': time.time(), 'counters': counters, 'rates': rates,
+                'gauges': {name: self.gauge(name) for name in gauges}, 'histograms': histograms}
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            lines += ['# TYPE ' + self.prefix + name + ' counter', self.prefix + name + ' ' + str(value)]
+        for name, value in snapshot['gauges'].items():
+            lines += ['# TYPE ' + self.prefix + name + ' gauge', self.prefix + name + ' ' + str(value)]
+        for name, histogram in snapshot['histograms'].items():
+            lines.append('# TYPE ' + self.prefix + name + ' histogram')
+            for bound, count in histogram['buckets'].items():
+                lines.append(self.prefix + name + '_bucket{le="' + bound + '"} ' + str(count))
+            lines.append(self.prefix + name + '_sum ' + str(histogram['sum']))
+            lines.append(self.prefix + name + '_count ' + str(histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    # sample rates and write metrics to files/ serve on localhost http port
+    # bind the HTTP port first, a port in use fails before any thread is started
+    def start(self, json_file='', prom_file='', interval=5, http_port=0, log=Log()):
+        if http_port and not self.__http_server:
+            self.__http_server = http.server.ThreadingHTTPServer(('127.0.0.1', http_port), MetricsHandler)
+            self.__http_server.metrics = self
+            threading.Thread(target=self.__http_server.serve_forever, daemon=True).start()
+            log.append('[INFO] Serving metrics on http://127.0.0.1:' + str(http_port) + '/metrics')
+        if not self.__export_worker:
+            self.__export_stop.clear()
+            self.__export_worker = threading.Thread(target=self.__exporter__, args=(json_file, prom_file, interval, log))
+            self.__export_worker.start()
+
+    def stop(self):
+        if self.__export_worker:
+            self.__export_stop.set()
+            self.__export_worker.join()
+            self.__export_worker = None
+        if self.__http_server:
+            self.__http_server.shutdown()
+            self.__http_server.server_close()
+            self.__http_server = None
+
+    @staticmethod
+    def write_file(file_name, content):
+        with open(file_name + '.tmp', 'w') as fp:
+            fp.write(content)
+        os.replace(file_name + '.tmp', file_name)
+
+    def __exporter__(self, json_file, prom_file, interval, log):
+        while True:
+            stopped = self.__export_stop.wait(interval)
+            self.sample()
+            try:
+                if json_file:
+                    Metrics.write_file(json_file, self.to_json())
+                if prom_file:
+                    Metrics.write_file(prom_file, self.to_prometheus())
+            except OSError as e:
+                log.append('[ERROR] Writing metrics failed: ' + str(e))
+            if stopped:
+                return
+
+
+# Serve metrics as Prometheus text on /metrics and as JSON on /metrics.json
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = self.server.metrics.to_prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = self.server.metrics.to_json(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Parallel directory scan, matching files are passed to notify while scanning
+class DirectoryScanner():
+    def __init__(self, path, regex='.*', recursive=False, notify=None, threads=4, progress_interval=10, log=Log()):
+        self.path = path
+        self.regex = re.compile(regex)
+        self.recursive = recursive
+        self.notify = notify
+        self.threads = threads if recursive else 1
+        self.progress_interval = progress_interval
+        self.scanned = 0
+        self.included = 0
+        self.__dirs = [path]
+        self.__pending = 0
+        self.__condition = threading.Condition()
+        self.__scan_workers = []
+        self.__running = False
+        self.__t_start = 0
+        self.__t_progress = 0
+        self.log = log
+
+    def start(self):
+        if not self.__scan_workers:
+            self.__running = True
+            self.__t_start = self.__t_progress = time.time()
+            self.__scan_workers = [threading.Thread(target=self.__scanner__) for _ in range(max(1, self.threads))]
+            for worker in self.__scan_workers:
+                worker.start()
+
+    def join(self):
+        for worker in self.__scan_workers:
+            worker.join()
+        self.__scan_workers = []
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        self.join()
+
+    def rate(self):
+        return self.scanned / max(time.time() - self.__t_start, 1e-6)
+
+    def __next_dir__(self):
+        with self.__condition:
+            while self.__running and not self.__dirs and self.__pending > 0:
+                self.__condition.wait()
+            if not self.__running or not self.__dirs:
+                return None
+            self.__pending += 1
+            return self.__dirs.pop()
+
+    def __done_dir__(self, subdirs, scanned, included):
+        with self.__condition:
+            self.__dirs.extend(subdirs)
+            self.__pending -= 1
+            self.scanned += scanned
+            self.included += included
+            t_now = time.time()
+            if self.__running and not self.__dirs and self.__pending == 0:
+                self.__running = False
+                self.log.append('[INFO] Included ' + str(self.included) + ' existing files, scanned ' + str(self.scanned) +
+                                ' files in ' + '{:.1f} s ({:.0f} files/s)'.format(t_now - self.__t_start, self.rate()))
+            elif t_now - self.__t_progress >= self.progress_interval:
+                self.__t_progress = t_now
+                self.log.append('[INFO] Scanning: included ' + str(self.included) + ' of ' + str(self.scanned) +
+                                ' files ({:.0f} files/s)'.format(self.rate()))
+            self.__condition.notify_all()
+
+    def __scanner__(self):
+        while True:
+            path = self.__next_dir__()
+            if path is None:
+                return
+            subdirs = []
+            scanned = included = 0
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if not self.__running:
+                            break
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.recursive:
+                                    subdirs.append(entry.path)
+                            elif entry.is_file():
+                                scanned += 1
+                                if self.regex.match(entry.name) and (not self.notify or self.notify(entry.path)):
+                                    included += 1
+                        except OSError:
+                            continue
+            except OSError as e:
+                self.log.append('[ERROR] Scanning ' + path + ' failed: ' + str(e))
+            self.__done_dir__(subdirs, scanned, included)
+
+
+# Persistent journal of queued, archived and shipped files
+class Journal():
+    QUEUED = 'queued'
+    ARCHIVED = 'archived'
+    SHIPPED = 'shipped'
+
+    def __init__(self, db_file, commit_interval=1000, log=Log()):
+        self.db_file = db_file
+        self.commit_interval = commit_interval
+        self.log = log
+        self.__uncommitted = 0
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(db_file, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, prefix TEXT, batch INTEGER, '
+                          'tar TEXT, size INTEGER, mtime REAL, state TEXT)')
+        self.__db.execute('CREATE INDEX IF NOT EXISTS files_tar ON files (tar)')
+        self.__db.commit()
+        self.__known = {name: (size, mtime) for name, size, mtime in self.__db.execute('SELECT name, size, mtime FROM files')}
+
+    def __contains__(self, file_name):
+        return file_name in self.__known
+
+    def close(self):
+        with self.__lock:
+            self.__db.commit()
+            self.__db.close()
+
+    # record new or changed file, return False if journaled with the same size and mtime
+    def queued(self, file_name, prefix=''):
+        try:
+            stat = os.stat(file_name)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = None, None
+        with self.__lock:
+            if file_name in self.__known and (size is None or self.__known[file_name] == (size, mtime)):
+                return False
+            self.__known[file_name] = (size, mtime)
+            self.__db.execute('INSERT OR REPLACE INTO files (name, prefix, size, mtime, state) VALUES (?, ?, ?, ?, ?)',
+                              (file_name, prefix, size, mtime, Journal.QUEUED))
+            # queued files are still in the source, commit in groups
+            self.__uncommitted += 1
+            if self.__uncommitted >= self.commit_interval:
+                self.__db.commit()
+                self.__uncommitted = 0
+        return True
+
+    def archived(self, prefix, batch, tar_name, file_names, shipped=False):
+        state = Journal.SHIPPED if shipped else Journal.ARCHIVED
+        with self.__lock:
+            self.__db.executemany('UPDATE files SET prefix=?, batch=?, tar=?, state=? WHERE name=?',
+                                  [(prefix, batch, tar_name, state, f) for f in file_names])
+            self.__db.commit()
+            self.__uncommitted = 0
+
+    def shipped(self, tar_file):
+        with self.__lock:
+            self.__db.execute('UPDATE files SET state=? WHERE tar=?', (Journal.SHIPPED, os.path.basename(tar_file)))
+            self.__db.commit()
+
+    def files(self, tar_file):
+        with self.__lock:
+            return [name for name, in self.__db.execute('SELECT name FROM files WHERE tar=?',
+                                                         (os.path.basename(tar_file),))]
+
+    def next_batch(self, prefix):
+        with self.__lock:
+            batch, = self.__db.execute('SELECT MAX(batch) FROM files WHERE prefix=?', (prefix,)).fetchone()
+        return batch + 1 if batch is not None else 0
+
+    def pending(self, prefix):
+        with self.__lock:
+            return [name for name, in self.__db.execute('SELECT name FROM files WHERE state=? AND prefix=? ORDER BY rowid',
+                                                         (Journal.QUEUED, prefix))]
+
+    def unshipped(self, prefix):
+        with self.__lock:
+            return [tar for tar, in self.__db.execute('SELECT DISTINCT tar FROM files WHERE state=? AND prefix=? ORDER BY batch',
+                                                       (Journal.ARCHIVED, prefix))]
+
+
+# Round robin queue over lanes, one busy lane can not starve the others
+class FairQueue():
+    def __init__(self):
+        self.__lanes = collections.OrderedDict()
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+    def size(self):
+        with self.__condition:
+            return sum(len(items) for items in self.__lanes.values())
+
+    def put(self, lane, item, front=False):
+        with self.__condition:
+            items = self.__lanes.setdefault(lane, collections.deque())
+            if front:
+                items.appendleft(item)
+            else:
+                items.append(item)
+            self.__condition.notify()
+
+    # next item of the next lane, (None, None) once closed and drained
+    def get(self):
+        with self.__condition:
+            while not self.__lanes and not self.__closed:
+                self.__condition.wait()
+            if not self.__lanes:
+                return None, None
+            lane, items = next(iter(self.__lanes.items()))
+            item = items.popleft()
+            if items:
+                self.__lanes.move_to_end(lane)
+            else:
+                del self.__lanes[lane]
+            return lane, item
+
+    # remove and return all items
+    def clear(self):
+        with self.__condition:
+            items = [item for items in self.__lanes.values() for item in items]
+            self.__lanes.clear()
+            return items
+
+    def open(self):
+        with self.__condition:
+            self.__closed = False
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+# Worker threads running jobs of several submitters fairly
+class WorkerPool():
+    def __init__(self, workers=2, log=Log()):
+        self.workers = workers
+        self.log = log
+        self.__queue = FairQueue()
+        self.__threads = []
+
+    def size(self):
+        return self.__queue.size()
+
+    def submit(self, lane, job):
+        self.__queue.put(lane, job)
+
+    def start(self):
+        if not self.__threads:
+            self.__queue.open()
+            self.__threads = [threading.Thread(target=self.__worker__) for _ in range(max(1, self.workers))]
+            for thread in self.__threads:
+                thread.start()
+
+    # run remaining jobs and stop workers
+    def stop(self):
+        if self.__threads:
+            self.__queue.close()
+            for thread in self.__threads:
+                thread.join()
+            self.__threads = []
+
+    def __worker__(self):
+        while True:
+            _, job = self.__queue.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                self.log.append('[ERROR] Worker job failed: ' + str(e))
+
+
+# File object wrapper hashing all data read or written
+class HashedFile():
+    def __init__(self, fileobj, algorithm='sha256'):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(algorithm)
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+# Writable file object wrapper passing each write through a throttle
+class ThrottledFile():
+    def __init__(self, fileobj, throttle):
+        self.fileobj = fileobj
+        self.throttle = throttle
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        self.throttle(len(data))
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+
+# Flow control for uploads and archiving
+# token bucket rate limit with optional daily windows e.g. '08:00-20:00=20' MB/s,
+# hill climbing number of upload channels on measured throughput and
+# backpressure if free space of the local/ temp directory runs low
+class TransferScheduler():
+    def __init__(self, path, rate_limit=0, schedule='', channels=4, max_channels=8, adaptive=True,
+                 min_free=0, interval=5, tune_interval=30, metrics=None, log=Log()):
+        self.path = path
+        self.rate_limit = rate_limit
+        self.windows = TransferScheduler.parse_schedule(schedule)
+        self.channels = max(1, min(channels, max_channels))
+        self.max_channels = max_channels
+        self.adaptive = adaptive
+        self.min_free = min_free
+        self.interval = interval
+        self.tune_interval = tune_interval
+        self.metrics = metrics or Metrics()
+        self.log = log
+        self.__tokens = 0.0
+        self.__t_tokens = time.time()
+        self.__active = 0
+        self.__busy = False
+        self.__transferred = 0
+        self.__best = 0.0
+        self.__best_channels = self.channels
+        self.__direction = 1
+        self.__disk_low = False
+        self.__lock = threading.Lock()
+        self.__condition = threading.Condition()
+        self.__stop_event = threading.Event()
+        self.__monitor_worker = None
+
+    # parse 'HH:MM-HH:MM=MBps' windows separated by ';' or ',', end of day may be given as 24:00
+    @staticmethod
+    def parse_schedule(schedule):
+        windows = []
+        for window in re.split('[;,]', schedule or ''):
+            if not window.strip():
+                continue
+            match = re.fullmatch(r'\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\d+(?:\.\d*)?)\s*', window)
+            if not match:
+                raise ValueError("Upload window '" + window.strip() + "' must look like '08:00-20:00=20'")
+            start_hour, start_minute, end_hour, end_minute = [int(t) for t in match.groups()[:4]]
+            for hour, minute in [(start_hour, start_minute), (end_hour, end_minute)]:
+                if minute > 59 or hour > 24 or (hour == 24 and minute > 0):
+                    raise ValueError("Upload window '" + window.strip() + "' has invalid time " +
+                                     str(hour) + ':' + str(minute).zfill(2))
+            windows.append((start_hour * 60 + start_minute, end_hour * 60 + end_minute, float(match.group(5))))
+        return windows
+
+    # current limit in bytes per second, 0 for unlimited
+    def current_rate(self):
+        t_local = time.localtime()
+        minute = t_local.tm_hour * 60 + t_local.tm_min
+        for start, end, rate in self.windows:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate * 1e6
+        return self.rate_limit * 1e6
+
+    def throttle(self, nbytes):
+        rate = self.current_rate()
+        with self.__lock:
+            self.__transferred += nbytes
+            if rate <= 0:
+                return
+            t_now = time.time()
+            self.__tokens = min(rate, self.__tokens + (t_now - self.__t_tokens) * rate) - nbytes
+            self.__t_tokens = t_now
+            t_wait = -self.__tokens / rate if self.__tokens < 0 else 0
+        if t_wait > 0:
+            time.sleep(t_wait)
+
+    def acquire_channel(self):
+        with self.__condition:
+            if self.__active >= self.channels:
+                self.__busy = True
+            while self.__active >= self.channels:
+                self.__condition.wait()
+            self.__active += 1
+
+    def release_channel(self):
+        with self.__condition:
+            self.__active -= 1
+            self.__condition.notify()
+
+    def disk_free(self):
+        try:
+            return shutil.disk_usage(self.path).free
+        except OSError:
+            return 0
+
+    def disk_low(self, nbytes=0):
+        return self.min_free > 0 and self.disk_free() - nbytes < self.min_free
+
+    # block until nbytes can be written keeping min_free, False if stopped meanwhile
+    def wait_for_disk(self, nbytes=0):
+        if not self.disk_low(nbytes):
+            return True
+        self.metrics.inc('disk_pauses_total')
+        self.log.append('[INFO] Low disk space on ' + self.path + ', pausing archiving')
+        while self.disk_low(nbytes):
+            if self.__stop_event.wait(self.interval):
+                return False
+        self.log.append('[INFO] Disk space available on ' + self.path + ', resuming archiving')
+        return True
+
+    def start(self):
+        if not self.__monitor_worker:
+            self.__stop_event.clear()
+            self.metrics.set('upload_channels', lambda: self.channels)
+            self.metrics.set('upload_rate_limit_bytes', self.current_rate)
+            self.metrics.set('disk_free_bytes', self.disk_free)
+            self.__monitor_worker = threading.Thread(target=self.__monitor__)
+            self.__monitor_worker.start()
+
+    def stop(self):
+        if self.__monitor_worker:
+            self.__stop_event.set()
+            self.__monitor_worker.join()
+            self.__monitor_worker = None
+
+    # climb towards the channel count with best throughput while uploads are waiting
+    def __tune__(self, throughput):
+        with self.__condition:
+            busy, self.__busy = self.__busy, False
+            if not busy or self.current_rate() > 0:
+                return
+            if throughput > self.__best:
+                self.__best, self.__best_channels = throughput, self.channels
+            elif throughput < self.__best * 0.9:
+                # clearly worse than the best so far, head back towards its channel count
+                self.__direction = 1 if self.__best_channels > self.channels else -1
+            # forget the best slowly, the link changes over time
+            self.__best *= 0.95
+            channels = max(1, min(self.max_channels, self.channels + self.__direction))
+            if channels != self.channels:
+                self.log.append('[INFO] Using ' + str(channels) + ' upload channels at ' +
+                                '{:.1f} MB/s'.format(throughput / 1e6))
+                self.channels = channels
+                self.__condition.notify_all()
+
+    def __monitor__(self):
+        t_tune = time.time()
+        while not self.__stop_event.wait(self.interval):
+            disk_low = self.disk_low()
+            if disk_low != self.__disk_low:
+                self.__disk_low = disk_low
+                if disk_low:
+                    self.log.append('[ERROR] Free space on ' + self.path + ' below ' +
+                                    str(int(self.min_free / 1e6)) + ' MB')
+            t_now = time.time()
+            if self.adaptive and t_now - t_tune >= self.tune_interval:
+                with self.__lock:
+                    transferred, self.__transferred = self.__transferred, 0
+                self.__tune__(transferred / (t_now - t_tune))
+                t_tune = t_now
 
 
 # Archive sets of files as tar balls
 class FileArchiver():
-    def __init__(self, dst_path, name_prefix='', batch_size=4000, count_offset=0, log=Log()):
+    # compression codecs with file suffix, default and maximum level
+    CODECS = {'zstd': ('.zst', 3, 22), 'gzip': ('.gz', 6, 9)}
+
+    def __init__(self, dst_path, name_prefix='', batch_size=4000, batch_bytes=0, max_age=0, count_offset=0,
+                 workers=1, pool=None, stream=None, streaming=True, verify=False, journal=None, scheduler=None,
+                 codec=None, level=0, min_saving=0.1, processes=None, metrics=None, log=Log()):
         self.dst_path = dst_path
+        self.codec = FileArchiver.resolve_codec(codec)
+        self.level = level or (FileArchiver.CODECS[self.codec][1] if self.codec else 0)
+        self.min_saving = min_saving
+        self.processes = processes
+        self.sample_files = 8
+        self.sample_bytes = 256 * 1024
+        self.pool = pool or WorkerPool(workers, log=log)
+        self.__own_pool = pool is None
+        self.metrics = metrics or Metrics()
+        self.scheduler = scheduler
+        self.stream = stream
+        self.streaming = streaming
+        self.verify = verify
+        self.journal = journal
+        self.stream_buffer = 1024 * 1024
         self.name_prefix = name_prefix
         self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.max_age = max_age
+        self.workers = workers
         self.__current_count = count_offset
+        self.__report_count = count_offset
+        self.__completed = {}
         self.__data_queue = []
+        self.__data_bytes = 0
+        self.__data_time = 0
         self.__archive_queue = []
+        self.__archive_jobs = 0
         self.__condition = threading.Condition()
-        self.__archive_worker = None
+        self.__report_lock = threading.Lock()
+        self.__running = False
+        self.__flush_worker = None
+        self.__flush_stop = threading.Event()
+        self.__added = set()
+        self.__file_info = {}
+        self.callbacks = []
+        self.shipped_callbacks = []
         self.log = log
 
     def __del__(self):
-        if self.__archive_worker:
+        if self.__running:
             self.stop()
 
-    def add(self, file_name):
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    # called with batch name once a streamed batch is on the remote host
+    def add_shipped_callback(self, callback):
+        self.shipped_callbacks.append(callback)
+
+    # number of queued files and batches waiting for a worker
+    def queue_sizes(self):
+        return len(self.__data_queue), len(self.__archive_queue)
+
+    # move queued files to a new batch and submit a job for it, caller holds the condition
+    def __cut__(self):
+        if self.__data_queue:
+            self.__archive_queue.append(self.__data_queue)
+            self.__data_queue = []
+            self.__data_bytes = 0
+            self.__archive_jobs += 1
+            self.pool.submit(self, self.__archive_next__)
+
+    # add file for archiving, files already added or journaled are skipped unless resumed
+    def add(self, file_name, resume=False, t_event=None):
+        if self.journal and not self.journal.queued(file_name, self.name_prefix) and not resume:
+            return False
+        try:
+            stat = os.stat(file_name)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = 0, None
         with self.__condition:
+            if not self.journal:
+                # changed files are added again
+                if (file_name, size, mtime) in self.__added:
+                    return False
+                self.__added.add((file_name, size, mtime))
+            # close batch before it exceeds the size limit
+            if self.batch_bytes > 0 and self.__data_bytes + size > self.batch_bytes:
+                self.__cut__()
+            if not self.__data_queue:
+                self.__data_time = time.time()
             self.__data_queue.append(file_name)
-            if len(self.__data_queue) >= self.batch_size:
-                self.__archive_queue.append(self.__data_queue[:self.batch_size])
-                del self.__data_queue[:self.batch_size]
-                self.__condition.notify_all()
+            self.__data_bytes += size
+            self.__file_info[file_name] = (t_event or time.time(), size)
+            self.metrics.inc('files_queued_total')
+            if len(self.__data_queue) >= self.batch_size or (self.batch_bytes > 0 and self.__data_bytes >= self.batch_bytes):
+                self.__cut__()
+        return True
+
+    # remove partial files of an interrupted run and continue numbering after existing batches
+    def __recover__(self):
+        pattern = re.compile(re.escape(self.name_prefix) + r'(\d+)\.tar')
+        try:
+            names = os.listdir(self.dst_path)
+        except OSError:
+            return
+        for name in names:
+            match = pattern.match(name)
+            if not match:
+                continue
+            if name.endswith('.part'):
+                try:
+                    os.remove(os.path.join(self.dst_path, name))
+                    self.log.append('[INFO] Removed partial file ' + name)
+                except OSError as e:
+                    self.log.append('[ERROR] Removing partial file ' + name + ' failed: ' + str(e))
+            elif int(match.group(1)) >= self.__current_count:
+                self.__current_count = self.__report_count = int(match.group(1)) + 1
 
     def start(self):
-        if not self.__archive_worker:
-            self.__archive_worker = threading.Thread(target=self.__archiver__)
-            self.__archive_worker.start()
+        if not self.__running:
+            self.__recover__()
+            self.__running = True
+            if self.__own_pool:
+                self.pool.start()
+            if self.max_age > 0:
+                self.__flush_stop.clear()
+                self.__flush_worker = threading.Thread(target=self.__flusher__)
+                self.__flush_worker.start()
 
+    # wait for all submitted batches, the pool keeps running if shared
     def stop(self, partial_write=True):
-        if self.__archive_worker:
+        if self.__running:
+            if self.__flush_worker:
+                self.__flush_stop.set()
+                self.__flush_worker.join()
+                self.__flush_worker = None
             with self.__condition:
-                if partial_write and len(self.__data_queue) > 0:
-                    self.__archive_queue.append(self.__data_queue)
-                self.__archive_queue.append([])
-                self.__condition.notify_all()
-            self.__archive_worker.join()
-            self.__archive_worker = None
-
-    def __archiver__(self):
-        while True:
-            while len(self.__archive_queue) > 0:
-                with self.__condition:
-                    batches = self.__archive_queue.copy()
+                if partial_write:
+                    self.__cut__()
+                else:
                     self.__archive_queue.clear()
-                for batch in batches:
-                    if not batch:
-                        return  # poison pill exit
+                while self.__archive_jobs > 0:
+                    self.__condition.wait()
+            if self.__own_pool:
+                self.pool.stop()
+            self.__running = False
+
+    # close batches once their oldest file waited max_age seconds
+    def __flusher__(self):
+        timeout = self.max_age
+        while not self.__flush_stop.wait(min(timeout, 1.0)):
+            with self.__condition:
+                timeout = self.max_age
+                if self.__data_queue:
+                    age = time.time() - self.__data_time
+                    if age >= self.max_age:
+                        self.log.append('[INFO] Closing batch of ' + str(len(self.__data_queue)) + ' files after ' +
+                                        str(int(age)) + ' s')
+                        self.__cut__()
+                    else:
+                        timeout = self.max_age - age
+
+    # 'auto' picks zstd if the zstandard package is installed, gzip otherwise
+    @staticmethod
+    def resolve_codec(codec):
+        if codec == 'auto':
+            return 'zstd' if zstandard is not None else 'gzip'
+        if codec and codec not in FileArchiver.CODECS:
+            raise ValueError('Unknown codec ' + codec)
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        return codec or None
+
+    # writable file object compressing into fileobj, fileobj is left open
+    @staticmethod
+    def compressor(fileobj, codec, level):
+        if codec == 'zstd':
+            return zstandard.ZstdCompressor(level=level).stream_writer(fileobj, closefd=False)
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level, mtime=0)
+
+    @staticmethod
+    def compress_bytes(data, codec, level):
+        if codec == 'zstd':
+            return zstandard.ZstdCompressor(level=level).compress(data)
+        return zlib.compress(data, level)
+
+    # read tar checksum from manifest header
+    @staticmethod
+    def manifest_checksum(manifest_file):
+        try:
+            with open(manifest_file, 'r') as fp:
+                fields = fp.readline().split()
+            return fields[3] if len(fields) >= 4 and fields[0] == '#' else None
+        except OSError:
+            return None
+
+    # manifest with tar name, size, sha256 and codec in header and one line per member
+    @staticmethod
+    def write_manifest(fileobj, name, tar_size, tar_checksum, members, codec=None):
+        lines = ['# ' + name + ' ' + str(tar_size) + ' ' + tar_checksum + ' ' + (codec or 'none')]
+        lines += [member + '\t' + str(size) + '\t' + checksum for member, size, checksum in members]
+        fileobj.write(('\n'.join(lines) + '\n').encode())
+
+    # write batch and hash members on the fly, return members, size and checksum of the written file
+    # and the files that vanished since they were queued
+    @staticmethod
+    def write_tar(fileobj, batch, stream=False, codec=None, level=0, bufsize=1024 * 1024):
+        out = HashedFile(fileobj)
+        members = []
+        missing = []
+        compressed = FileArchiver.compressor(out, codec, level) if codec else None
+        with tarfile.open(fileobj=compressed or out, mode='w|' if stream or codec else 'w', bufsize=bufsize) as fp:
+            for f in batch:
+                try:
+                    tarinfo = fp.gettarinfo(f, arcname=os.path.basename(f))
+                    if not tarinfo.isreg():
+                        fp.addfile(tarinfo)
+                        continue
+                    src = open(f, 'rb')
+                except FileNotFoundError:
+                    missing.append(f)
+                    continue
+                with src:
+                    reader = HashedFile(src)
+                    fp.addfile(tarinfo, reader)
+                members.append((tarinfo.name, tarinfo.size, reader.hexdigest()))
+        if compressed:
+            compressed.close()
+        return members, out.size, out.hexdigest(), missing
+
+    # compression processes ignore SIGINT/ SIGTERM sent to the process group, the app stops them
+    @staticmethod
+    def init_process():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # write batch to new local file, runs in the compression process pool
+    @staticmethod
+    def write_batch(dst, batch, codec=None, level=0, bufsize=1024 * 1024):
+        with open(dst, 'wb') as fp:
+            return FileArchiver.write_tar(fp, batch, codec=codec, level=level, bufsize=bufsize)
+
+    # codec for batch, None if samples from the middle of some members do not compress well
+    def __select_codec__(self, batch):
+        if not self.codec:
+            return None
+        raw, compressed = 0, 0
+        for f in batch[::max(1, len(batch) // self.sample_files)][:self.sample_files]:
+            try:
+                with open(f, 'rb') as fp:
+                    fp.seek(max(0, os.fstat(fp.fileno()).st_size // 2 - self.sample_bytes // 2))
+                    data = fp.read(self.sample_bytes)
+            except OSError:
+                continue
+            raw += len(data)
+            compressed += len(FileArchiver.compress_bytes(data, self.codec, self.level))
+        if raw and compressed <= raw * (1 - self.min_saving):
+            return self.codec
+        self.metrics.inc('batches_compression_skipped_total')
+        return None
+
+    # stream batch directly into remote file, return vanished files or None to spill over to local file
+    def __stream_batch__(self, name, batch, codec=None):
+        opened = False
+        try:
+            if self.stream.exists(name):
+                self.log.append('[ERROR] Remote file ' + name + ' already exists, writing local copy')
+                return None
+            t_start = time.time()
+            opened = True
+            with self.stream.open_remote(name) as fp:
+                members, tar_size, tar_checksum, missing = FileArchiver.write_tar(fp, batch, stream=True, codec=codec,
+                                                                                  level=self.level,
+                                                                                  bufsize=self.stream_buffer)
+            if self.verify and not self.stream.verify_remote(name, tar_checksum, partial=True):
+                raise IOError('remote checksum mismatch')
+            self.stream.commit_remote(name)
+            with self.stream.open_remote(name + '.manifest') as fp:
+                FileArchiver.write_manifest(fp, name, tar_size, tar_checksum, members, codec)
+            self.stream.commit_remote(name + '.manifest')
+            manifest = os.path.join(self.dst_path, name + '.manifest')
+            with open(manifest + '.part', 'wb') as fp:
+                FileArchiver.write_manifest(fp, name, tar_size, tar_checksum, members, codec)
+            os.replace(manifest + '.part', manifest)
+            if codec:
+                self.metrics.inc('bytes_compressed_total', tar_size)
+            self.metrics.observe('upload_seconds', time.time() - t_start)
+            return missing
+        except Exception as e:
+            self.log.append('[ERROR] Streaming ' + name + ' failed: ' + str(e) + ', writing local copy')
+            # cleaning up would reconnect for each file if the host is gone
+            if not opened or not self.stream.is_connected():
+                return None
+            for remote_name in [name, name + '.manifest']:
+                for partial in [True, False]:
                     try:
-                        dst = os.path.join(self.dst_path, self.name_prefix + str(self.__current_count) + '.tar')
-                        if os.path.isfile(dst):
-                            self.log.append('[ERROR] File ' + dst + ' already exists, skiped writing')
-                            continue
-                        with tarfile.open(dst, 'w') as fp:
-                            for f in batch:
-                                fp.add(f, arcname=os.path.basename(f))
-                            self.log.append('Archived ' + str(len(batch)) + ' files as ' + self.name_prefix + str(self.__current_count) + '.tar')
-                            self.__current_count += 1
-                    except FileExistsError as e:
-                        self.log.append('[ERROR] File ' + self.name_prefix + str(self.__current_count) + '.tar' + ' already exists, output NOT written')                
+                        self.stream.remove_remote(remote_name, partial=partial)
+                    except Exception:
+                        pass
+            return None
+
+    # take next batch and reserve its number, numbers follow queue order
+    def __next_batch__(self):
+        skipped = []
+        with self.__condition:
+            if not self.__archive_queue:
+                return None, None, None
+            batch = self.__archive_queue.pop(0)
+            while True:
+                count = self.__current_count
+                self.__current_count += 1
+                name = self.name_prefix + str(count) + '.tar'
+                dst = os.path.join(self.dst_path, name)
+                if not any(os.path.isfile(dst + suffix) for suffix in [''] + [codec[0] for codec in FileArchiver.CODECS.values()]):
+                    break
+                self.log.append('[ERROR] File ' + dst + ' already exists, using next batch number')
+                skipped.append(count)
+        # unused numbers must not hold back reporting of later batches
+        for skipped_count in skipped:
+            self.__report__(skipped_count, None, None, [], failed=True)
+        return count, name, batch
+
+    # report finished batches strictly in batch number order
+    def __report__(self, count, name, dst, batch, failed=False):
+        with self.__report_lock:
+            self.__completed[count] = (name, dst, batch, failed)
+            while self.__report_count in self.__completed:
+                count = self.__report_count
+                name, dst, batch, failed = self.__completed.pop(count)
+                self.__report_count += 1
+                t_now = time.time()
+                batch_bytes = 0
+                with self.__condition:
+                    info = [self.__file_info.pop(f, (t_now, 0)) for f in batch]
+                if failed:
+                    continue
+                for t_event, size in info:
+                    self.metrics.observe('event_to_archive_seconds', t_now - t_event)
+                    batch_bytes += size
+                self.metrics.inc('files_archived_total', len(batch))
+                self.metrics.inc('bytes_archived_total', batch_bytes)
+                self.metrics.inc('batches_archived_total')
+                if self.journal:
+                    self.journal.archived(self.name_prefix, count, name, batch, shipped=dst is None)
+                if dst is None:
+                    self.metrics.inc('batches_uploaded_total')
+                    self.metrics.inc('bytes_uploaded_total', batch_bytes)
+                    self.log.append('Streamed ' + str(len(batch)) + ' files as ' + name)
+                    for callback in self.shipped_callbacks:
+                        callback(name)
+                    continue
+                self.log.append('Archived ' + str(len(batch)) + ' files as ' + name)
+                for callback in self.callbacks:
+                    callback(dst)
+
+    # pool job archiving the next queued batch
+    def __archive_next__(self):
+        try:
+            self.__archive_batch__()
+        finally:
             with self.__condition:
-                self.__condition.wait()
+                self.__archive_jobs -= 1
+                self.__condition.notify_all()
 
+    # files removed after they were queued are left out of the batch, the rest is archived
+    def __skip_missing__(self, name, batch, missing):
+        if not missing:
+            return batch
+        for f in missing:
+            self.log.append('[ERROR] File ' + f + ' vanished, not archived in ' + name)
+        with self.__condition:
+            for f in missing:
+                self.__file_info.pop(f, None)
+        missing = set(missing)
+        return [f for f in batch if f not in missing]
 
-# SCP client
+    def __archive_batch__(self):
+        count, name, batch = self.__next_batch__()
+        if batch is None:
+            return
+        dst = os.path.join(self.dst_path, name)
+        try:
+            codec = self.__select_codec__(batch)
+            if codec:
+                name += FileArchiver.CODECS[codec][0]
+            dst = os.path.join(self.dst_path, name)
+            with self.__condition:
+                batch_bytes = sum(self.__file_info.get(f, (0, 0))[1] for f in batch)
+            # stream if requested or to avoid filling the local disk
+            disk_low = self.scheduler is not None and self.scheduler.disk_low(batch_bytes)
+            t_start = time.time()
+            missing = self.__stream_batch__(name, batch, codec) if self.stream and (self.streaming or disk_low) else None
+            if missing is not None:
+                self.metrics.observe('tar_write_seconds', time.time() - t_start)
+                self.__report__(count, name, None, self.__skip_missing__(name, batch, missing))
+                return
+            if self.scheduler is not None and not self.scheduler.wait_for_disk(batch_bytes):
+                # stopped while the disk is full, journaled files are archived on the next start
+                self.log.append('[ERROR] Low disk space, ' + str(len(batch)) + ' files of ' + name + ' not archived')
+                self.__report__(count, name, None, batch, failed=True)
+                return
+            t_start = time.time()
+            # compress in a separate process, the worker thread only waits
+            # tar and manifest get their final names only once complete, the tar last
+            members = None
+            if codec and self.processes is not None:
+                try:
+                    members, tar_size, tar_checksum, missing = self.processes.submit(
+                        FileArchiver.write_batch, dst + '.part', batch, codec, self.level, self.stream_buffer).result()
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    self.log.append('[ERROR] Compression process failed: ' + str(e) + ', compressing ' + name + ' in thread')
+            if members is None:
+                members, tar_size, tar_checksum, missing = FileArchiver.write_batch(dst + '.part', batch, codec,
+                                                                                    self.level, self.stream_buffer)
+            with open(dst + '.manifest.part', 'wb') as fp:
+                FileArchiver.write_manifest(fp, name, tar_size, tar_checksum, members, codec)
+            os.replace(dst + '.manifest.part', dst + '.manifest')
+            os.replace(dst + '.part', dst)
+            if codec:
+                self.metrics.inc('bytes_compressed_total', tar_size)
+            self.metrics.observe('tar_write_seconds', time.time() - t_start)
+            self.__report__(count, name, dst, self.__skip_missing__(name, batch, missing))
+        except Exception as e:
+            self.log.append('[ERROR] Archiving ' + name + ' failed: ' + str(e))
+            for partial in [dst + '.part', dst + '.manifest.part']:
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+            self.__report__(count, name, None, batch, failed=True)
+
+
+# SCP client, one persistent transport shared by parallel SFTP channels
 class SCP():
-    def __init__(self):
-        pass
+    def __init__(self, host, username, password=None, key_file=None, port=22,
+                 remote_path='', channels=4, retry_delay=5, max_retry_delay=300, verify=False, scheduler=None,
+                 trust_new_host=False, known_hosts=os.path.join('~', '.ssh', 'known_hosts'), metrics=None, log=Log()):
+        self.host = host
+        self.trust_new_host = trust_new_host
+        self.known_hosts = os.path.expanduser(known_hosts)
+        self.scheduler = scheduler
+        self.verify = verify
+        self.metrics = metrics or Metrics()
+        self.port = port
+        self.username = username
+        self.password = password
+        self.key_file = key_file
+        self.remote_path = remote_path
+        self.channels = channels
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.chunk_size = 4 * 1024 * 1024
+        self.window_size = 64 * 1024 * 1024
+        self.packet_size = 256 * 1024
+        self.__transport = None
+        self.__transport_lock = threading.Lock()
+        self.__upload_queue = FairQueue()
+        self.__upload_workers = []
+        self.__stop_event = threading.Event()
+        self.__attempts = {}
+        self.__local = threading.local()
+        self.callbacks = []
+        self.log = log
+
+    def __del__(self):
+        if self.__upload_workers:
+            self.stop()
+
+    def __load_key__(self):
+        for key_class in [paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key]:
+            try:
+                return key_class.from_private_key_file(self.key_file, password=self.password or None)
+            except paramiko.SSHException:
+                continue
+        raise paramiko.SSHException('Unsupported private key ' + self.key_file)
+
+    # unknown hosts are rejected unless trust_new_host, then their key is saved on first use
+    def __check_host_key__(self, transport):
+        host_keys = paramiko.HostKeys()
+        if os.path.isfile(self.known_hosts):
+            host_keys.load(self.known_hosts)
+        lookup = self.host if self.port == 22 else '[' + self.host + ']:' + str(self.port)
+        known = host_keys.lookup(lookup)
+        key = transport.get_remote_server_key()
+        fingerprint = 'SHA256:' + base64.b64encode(hashlib.sha256(key.asbytes()).digest()).decode().rstrip('=')
+        if known and key.get_name() in known:
+            if known[key.get_name()] != key:
+                raise paramiko.SSHException('Host key of ' + self.host + ' does not match ' + self.known_hosts)
+            return
+        if not self.trust_new_host:
+            raise paramiko.SSHException('Unknown ' + key.get_name() + ' host key ' + fingerprint + ' of ' + self.host +
+                                        ', add it to ' + self.known_hosts + ' or trust new hosts')
+        host_keys.add(lookup, key.get_name(), key)
+        os.makedirs(os.path.dirname(self.known_hosts), exist_ok=True)
+        host_keys.save(self.known_hosts)
+        self.log.append('[INFO] Trusted new ' + key.get_name() + ' host key ' + fingerprint + ' of ' + self.host +
+                        ', saved to ' + self.known_hosts)
+
+    # return active transport, reconnect if necessary
+    def connect(self):
+        with self.__transport_lock:
+            if self.__transport and self.__transport.is_active():
+                return self.__transport
+            if self.__transport:
+                self.__transport.close()
+                self.log.append('[INFO] Reconnecting to ' + self.host)
+            sock = socket.create_connection((self.host, self.port), timeout=30)
+            transport = paramiko.Transport(sock, default_window_size=self.window_size,
+                                           default_max_packet_size=self.packet_size)
+            try:
+                transport.use_compression(False)
+                transport.start_client(timeout=30)
+                self.__check_host_key__(transport)
+                if self.key_file:
+                    transport.auth_publickey(self.username, self.__load_key__())
+                else:
+                    transport.auth_password(self.username, self.password)
+                transport.set_keepalive(30)
+            except:
+                transport.close()
+                raise
+            self.__transport = transport
+            return transport
+
+    def close(self):
+        with self.__transport_lock:
+            if self.__transport:
+                self.__transport.close()
+                self.__transport = None
+
+    def is_connected(self):
+        return self.__transport is not None and self.__transport.is_active()
+
+    # files are written to a partial name and renamed once complete
+    def remote_name(self, file_name, partial=False):
+        return posixpath.join(self.remote_path, os.path.basename(file_name)) + ('.part' if partial else '')
+
+    # per thread SFTP channel on the shared transport
+    def sftp(self):
+        sftp = getattr(self.__local, 'sftp', None)
+        transport = getattr(self.__local, 'transport', None)
+        if sftp is None or transport is not self.__transport or not transport.is_active():
+            self.close_sftp()
+            transport = self.connect()
+            self.__local.sftp = paramiko.SFTPClient.from_transport(transport)
+            self.__local.transport = transport
+        return self.__local.sftp
+
+    def close_sftp(self):
+        sftp = getattr(self.__local, 'sftp', None)
+        if sftp:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+        self.__local.sftp = None
+
+    def exists(self, file_name):
+        try:
+            self.sftp().stat(self.remote_name(file_name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    # size of the partial remote file, 0 if there is none
+    def partial_size(self, file_name):
+        try:
+            return self.sftp().stat(self.remote_name(file_name, partial=True)).st_size
+        except FileNotFoundError:
+            return 0
+
+    # size of the remote file, None if there is none
+    def remote_size(self, file_name):
+        try:
+            return self.sftp().stat(self.remote_name(file_name)).st_size
+        except FileNotFoundError:
+            return None
+
+    # writable partial remote file, continued at offset, finished by commit_remote
+    def open_remote(self, file_name, offset=0):
+        fp = self.sftp().open(self.remote_name(file_name, partial=True), 'r+b' if offset else 'wb', bufsize=1024 * 1024)
+        fp.set_pipelined(True)
+        if offset:
+            fp.seek(offset)
+        if self.scheduler is not None:
+            return ThrottledFile(fp, self.scheduler.throttle)
+        return fp
+
+    # atomically move the complete partial file to its final name
+    def commit_remote(self, file_name):
+        sftp = self.sftp()
+        partial, final = self.remote_name(file_name, partial=True), self.remote_name(file_name)
+        try:
+            sftp.posix_rename(partial, final)
+        except IOError:
+            # no posix-rename@openssh.com extension, plain rename fails on existing files
+            try:
+                sftp.remove(final)
+            except FileNotFoundError:
+                pass
+            sftp.rename(partial, final)
+
+    def remove_remote(self, file_name, partial=False):
+        self.sftp().remove(self.remote_name(file_name, partial=partial))
+
+    # compare checksum with sha256sum of the remote file
+    def verify_remote(self, file_name, checksum, partial=False):
+        channel = self.connect().open_session()
+        try:
+            channel.exec_command('sha256sum ' + shlex.quote(self.remote_name(file_name, partial=partial)))
+            output = channel.makefile('rb').read().decode()
+            if channel.recv_exit_status() != 0:
+                raise paramiko.SSHException('remote sha256sum failed on ' + os.path.basename(file_name))
+        finally:
+            channel.close()
+        return output.split()[:1] == [checksum]
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def queue_size(self):
+        return self.__upload_queue.size()
+
+    # queue file for upload, lanes e.g. flow cells are served round robin
+    def put(self, file_name, lane=None):
+        self.__upload_queue.put(lane, file_name)
+
+    def start(self):
+        if not self.__upload_workers:
+            self.__stop_event.clear()
+            self.__upload_queue.open()
+            try:
+                self.connect()
+                self.log.append('[INFO] Connected to ' + self.host)
+            except Exception as e:
+                self.log.append('[ERROR] Connecting to ' + self.host + ' failed: ' + str(e))
+            self.__upload_workers = [threading.Thread(target=self.__uploader__) for _ in range(max(1, self.channels))]
+            for worker in self.__upload_workers:
+                worker.start()
+
+    # upload queued batches for up to timeout seconds while connected, then finish running uploads only,
+    # batches left in the queue stay local and are resumed from the journal
+    def stop(self, timeout=0):
+        if self.__upload_workers:
+            self.__upload_queue.close()
+            if timeout > 0 and self.is_connected():
+                t_end = time.time() + timeout
+                for worker in self.__upload_workers:
+                    worker.join(max(0, t_end - time.time()))
+            self.__stop_event.set()
+            dropped = self.__upload_queue.clear()
+            if dropped:
+                self.log.append('[INFO] Stopped uploading, ' + str(len(dropped)) + ' batches left in local directory: ' +
+                                ', '.join(os.path.basename(file_name) for file_name in dropped))
+            for worker in self.__upload_workers:
+                worker.join()
+            self.__upload_workers = []
+            self.close()
+
+    # upload in chunks to the partial name, continue a previous partial upload
+    # existing remote batches are never overwritten, one matching the local batch was uploaded before a restart
+    def __upload__(self, file_name):
+        t_start = time.time()
+        size = os.path.getsize(file_name)
+        manifest = file_name + '.manifest'
+        checksum = FileArchiver.manifest_checksum(manifest)
+        if self.verify and checksum is None:
+            raise IOError('no checksum to verify ' + os.path.basename(file_name))
+        remote_size = self.remote_size(file_name)
+        if remote_size is not None:
+            if remote_size != size or (self.verify and not self.verify_remote(file_name, checksum)):
+                self.metrics.inc('upload_errors_total')
+                self.log.append('[ERROR] Remote file ' + os.path.basename(file_name) + ' already exists, kept local copy')
+                return
+            self.log.append('[INFO] Remote file ' + os.path.basename(file_name) + ' was already uploaded')
+            offset = size
+        else:
+            offset = self.partial_size(file_name)
+            if offset > size:
+                offset = 0
+            if offset:
+                self.metrics.inc('bytes_resumed_total', offset)
+                self.log.append('[INFO] Resuming upload of ' + os.path.basename(file_name) + ' at ' +
+                                '{:.1f} MB'.format(offset / 1e6))
+            with open(file_name, 'rb') as src, self.open_remote(file_name, offset=offset) as dst:
+                src.seek(offset)
+                while True:
+                    chunk = src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            if self.partial_size(file_name) != size:
+                raise IOError('incomplete remote file ' + os.path.basename(file_name))
+            if self.verify and not self.verify_remote(file_name, checksum, partial=True):
+                self.remove_remote(file_name, partial=True)
+                raise IOError('remote checksum mismatch of ' + os.path.basename(file_name))
+            self.commit_remote(file_name)
+        if os.path.isfile(manifest):
+            with open(manifest, 'rb') as src, self.open_remote(manifest) as dst:
+                shutil.copyfileobj(src, dst)
+            self.commit_remote(manifest)
+        t_elapsed = max(time.time() - t_start, 1e-6)
+        self.metrics.observe('upload_seconds', t_elapsed)
+        self.metrics.inc('bytes_uploaded_total', size - offset)
+        self.metrics.inc('batches_uploaded_total')
+        self.log.append('Uploaded ' + os.path.basename(file_name) + ' (' +
+                        '{:.1f} MB at {:.1f} MB/s'.format((size - offset) / 1e6, (size - offset) / 1e6 / t_elapsed) + ')')
+        for callback in self.callbacks:
+            callback(file_name)
+
+    def __uploader__(self):
+        while True:
+            lane, file_name = self.__upload_queue.get()
+            if file_name is None:
+                break   # closed and drained
+            try:
+                if self.scheduler is not None:
+                    self.scheduler.acquire_channel()
+                try:
+                    self.__upload__(file_name)
+                finally:
+                    if self.scheduler is not None:
+                        self.scheduler.release_channel()
+                self.__attempts.pop(file_name, None)
+            except Exception as e:
+                self.close_sftp()
+                self.metrics.inc('upload_errors_total')
+                if self.__stop_event.is_set():
+                    self.log.append('[ERROR] Upload of ' + os.path.basename(file_name) + ' failed: ' + str(e) + ', kept local copy')
+                    continue
+                # exponential backoff, the partial remote file is continued on the next attempt
+                attempt = self.__attempts.get(file_name, 0) + 1
+                self.__attempts[file_name] = attempt
+                delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+                self.metrics.inc('upload_retries_total')
+                self.metrics.observe('upload_retry_delay_seconds', delay)
+                self.log.append('[ERROR] Upload of ' + os.path.basename(file_name) + ' failed: ' + str(e) +
+                                ', retry ' + str(attempt) + ' in ' + str(delay) + ' s')
+                if self.__stop_event.wait(delay):
+                    self.log.append('[INFO] Upload of ' + os.path.basename(file_name) + ' stopped, kept local copy')
+                    continue
+                self.__upload_queue.put(lane, file_name, front=True)
+        self.close_sftp()
+
+
+# Sequencing run watched by the app, own source, regex, prefix and batch counter
+# archive workers, upload channels, journal and scheduler are shared by all runs
+class FlowCell():
+    def __init__(self, cell_id, source_path, regex='.*fast5$', batch_prefix='', batch_offset=0,
+                 recursive=False, ignore_existing=False):
+        self.cell_id = cell_id
+        self.source_path = source_path
+        self.regex = regex
+        self.batch_prefix = batch_prefix
+        self.batch_offset = batch_offset
+        self.recursive = recursive
+        self.ignore_existing = ignore_existing
+        self.archiver = None
+        self.file_queue = None
+        self.observer = None
+        self.scanner = None
+
+    def start(self, app):
+        batch_offset = self.batch_offset
+        if app.journal:
+            batch_offset = max(batch_offset, app.journal.next_batch(self.batch_prefix))
+        self.archiver = FileArchiver(app.export_path, name_prefix=self.batch_prefix,
+                                     batch_size=app.batch_size, batch_bytes=app.batch_mb * 1000000,
+                                     max_age=app.batch_age, count_offset=batch_offset, pool=app.pool,
+                                     verify=app.ssh_verify, journal=app.journal, scheduler=app.scheduler,
+                                     codec=app.compression, level=app.compression_level,
+                                     min_saving=app.compression_min_saving, processes=app.processes,
+                                     metrics=app.metrics, log=app.log)
+        if app.scp:
+            self.archiver.add_callback(lambda tar_file: app.scp.put(tar_file, lane=self.cell_id))
+            self.archiver.add_shipped_callback(app.on_batch_shipped)
+            self.archiver.stream = app.scp
+            self.archiver.streaming = app.ssh_stream
+        self.archiver.start()
+        if app.journal:
+            self.resume_journal(app)
+        self.file_queue = TimedSet(delay=app.delay, notify=self.on_file_settled)
+        self.file_queue.start()
+        watchdog = FileHandler(regex=[self.regex], notify=lambda file_name: self.on_file_event(app, file_name))
+        if app.polling:
+            observer = DirectoryPoller(interval=app.poll_interval, settle_time=app.delay)
+        else:
+            observer = Observer()
+        observer.schedule(watchdog, path=self.source_path, recursive=self.recursive)
+        observer.start()
+        self.observer = observer
+        app.log.append('[INFO] Started File System Observer for ' + self.cell_id + ' in ' + self.source_path)
+        if not self.ignore_existing:
+            self.scanner = DirectoryScanner(self.source_path, regex=self.regex, recursive=self.recursive,
+                                            notify=lambda file_name: self.on_file_scanned(app, file_name),
+                                            threads=app.scan_threads, log=app.log)
+            self.scanner.start()
+
+    # stop watching, settle pending files and write the last batch, also after a partial start
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.scanner:
+            self.scanner.stop()
+            self.scanner = None
+        if self.file_queue is not None:
+            self.file_queue.stop()
+            for name in self.file_queue.get(t_wait=0):
+                if os.path.isfile(name):
+                    self.archiver.add(name)
+        if self.archiver is not None:
+            self.archiver.stop()
+
+    # continue where a previous run stopped
+    def resume_journal(self, app):
+        if app.scp:
+            unshipped = [os.path.join(app.export_path, tar) for tar in app.journal.unshipped(self.batch_prefix)]
+            unshipped = [tar for tar in unshipped if os.path.isfile(tar)]
+            for tar in unshipped:
+                app.scp.put(tar, lane=self.cell_id)
+            if unshipped:
+                app.log.append('[INFO] Resumed upload of ' + str(len(unshipped)) + ' batches of ' + self.cell_id + ' from journal')
+        pending = [name for name in app.journal.pending(self.batch_prefix) if os.path.isfile(name)]
+        for name in pending:
+            self.archiver.add(name, resume=True)
+        if pending:
+            app.log.append('[INFO] Resumed ' + str(len(pending)) + ' pending files of ' + self.cell_id + ' from journal')
+
+    def on_file_event(self, app, file_name):
+        app.metrics.inc('file_events_total')
+        self.file_queue.put(file_name)
+
+    # existing files still being written settle like new ones
+    def on_file_scanned(self, app, file_name):
+        try:
+            if time.time() - os.path.getmtime(file_name) < app.delay:
+                self.file_queue.put(file_name)
+                return True
+        except OSError:
+            return False
+        return self.archiver.add(file_name)
+
+    def on_file_settled(self, file_name, t_event=None):
+        if os.path.isfile(file_name):
+            self.archiver.add(file_name, t_event=t_event)
 
 
 # MinION Export Deamon app
@@ -144,301 +1765,372 @@ class app_core():
         self.usr1 = ''
         self.usr2 = ''
         # ssh
+        self.ssh_host = ''
+        self.ssh_port = 22
+        self.ssh_user = ''
+        self.ssh_pw = ''
+        self.ssh_key = ''
+        self.ssh_remote_path = ''
+        self.ssh_channels = 4
+        self.ssh_max_channels = 8
+        self.ssh_stream = False
+        self.ssh_verify = False
+        self.ssh_trust_new_host = False
+        self.ssh_known_hosts = os.path.join('~', '.ssh', 'known_hosts')
+        self.delete_source = False
+        self.keep_shipped = False
+        # seconds to upload the batches written at stop
+        self.ssh_stop_timeout = 60
+        self.scp = None
+        # flow control
+        self.upload_rate = 0.0
+        self.upload_schedule = ''
+        self.adaptive_channels = True
+        self.min_free_mb = 1000
+        self.scheduler = None
+        # journal
+        self.use_journal = True
+        self.journal_name = 'nanoscp_journal.sqlite'
+        self.journal = None
+        # metrics
+        self.metrics = Metrics()
+        self.metrics_file = ''
+        self.metrics_interval = 5
+        self.metrics_port = 0
 
         # options
         self.regex = '.*fast5$'
         self.batch_size = 4000
+        self.batch_mb = 0
+        self.batch_age = 0
         self.batch_offset = 0
+        self.archive_workers = 2
         self.delay = 60
+        # compression, '' off, 'auto', 'zstd' or 'gzip', level 0 uses the codec default
+        self.compression = ''
+        self.compression_level = 0
+        self.compression_workers = 0
+        self.compression_min_saving = 0.1
+        self.processes = None
         self.recursive = False
         self.ignore_existing = False
-        self.watchdog = None
-        self.file_queue = None
-        self.archiver = None
+        self.scan_threads = 8
+        self.polling = False
+        self.poll_interval = 5
+        # additional runs as dicts of FlowCell settings, e.g. one per GridION position
+        self.runs = []
+        self.cells = []
+        self.pool = None
         self.log = log
         
     def is_startable(self):
         startable = True
         try:
-            if not os.path.isdir(self.source_path):
+            cells = self.flow_cells()
+            for cell in cells:
+                if not os.path.isdir(cell.source_path):
+                    startable = False
+                    self.log.append('[ERROR] Source of ' + cell.cell_id + ' is not a directory')
+            if len(set(cell.batch_prefix for cell in cells)) < len(cells):
                 startable = False
-                self.log.append('[ERROR] Source is not a directory')
+                self.log.append('[ERROR] Each run needs its own cell id or batch prefix')
             if not os.path.isdir(self.export_path):
                 startable = False
                 self.log.append('[ERROR] Destination is not a directory')
             if self.batch_size < 1:
                 startable = False
                 self.log.append('[ERROR] Batch size must be greater one')
+            if self.batch_mb < 0 or self.batch_age < 0:
+                startable = False
+                self.log.append('[ERROR] Batch MB and max. age must not be negative')
+            try:
+                codec = FileArchiver.resolve_codec(self.compression)
+                if codec and not 0 <= self.compression_level <= FileArchiver.CODECS[codec][2]:
+                    startable = False
+                    self.log.append('[ERROR] Compression level of ' + codec + ' must be 1 to ' +
+                                    str(FileArchiver.CODECS[codec][2]) + ', 0 for the default')
+            except ValueError as e:
+                startable = False
+                self.log.append('[ERROR] ' + str(e))
+            if self.ssh_host and not self.ssh_user:
+                startable = False
+                self.log.append('[ERROR] SCP user is required for remote export')
+            if self.ssh_key and not os.path.isfile(self.ssh_key):
+                startable = False
+                self.log.append('[ERROR] SCP key is not a file')
+            try:
+                TransferScheduler.parse_schedule(self.upload_schedule)
+            except ValueError as e:
+                startable = False
+                self.log.append('[ERROR] ' + str(e))
+            if self.delete_source and not (self.ssh_host and self.ssh_verify and self.use_journal):
+                startable = False
+                self.log.append('[ERROR] Deleting source files requires remote export with verification and journal')
         except:
             return False
         return startable
 
+    # runs to watch, the app settings form the first run unless only additional runs are configured
+    def flow_cells(self):
+        cells = []
+        if self.source_path or not self.runs:
+            cells.append(FlowCell(self.cell_id, self.source_path, regex=self.regex, batch_prefix=self.batch_prefix,
+                                  batch_offset=self.batch_offset, recursive=self.recursive,
+                                  ignore_existing=self.ignore_existing))
+        for run in self.runs:
+            settings = {'regex': self.regex, 'batch_offset': self.batch_offset, 'recursive': self.recursive,
+                        'ignore_existing': self.ignore_existing}
+            settings.update(run)
+            settings.setdefault('batch_prefix', self.batch_prefix + settings['cell_id'] + '_')
+            cells.append(FlowCell(**settings))
+        return cells
+
     def start_watchdog(self):
         try:
-            self.archiver = FileArchiver(self.export_path, name_prefix=self.batch_prefix, 
-                                         batch_size=self.batch_size, count_offset=self.batch_offset,
-                                         log=self.log)
-            self.archiver.start()
-            self.file_queue = TimedSet()
-            self.watchdog = FileHandler(regex=[self.regex], notify=self.on_file_event)
-            self.observer = Observer()
-            self.observer.schedule(self.watchdog, path=self.source_path, recursive=self.recursive)
-            self.observer.start()
-            self.log.append('[INFO] Started File System Observer')
-            if not self.ignore_existing:
-                if self.recursive:
-                    existing = [os.path.join(dirpath, f) for dirpath, _, files in os.walk(self.source_path) for f in files if re.match(self.regex, f)]
-                else:
-                    existing = [os.path.join(self.source_path, f) for f in os.listdir(self.source_path) if re.match(self.regex, f)]
-                for ex in existing:
-                    self.archiver.add(ex)
-                self.log.append('[INFO] Included ' + str(len(existing)) + ' existing files')
+            self.cells = []
+            self.metrics.set('pending_files', lambda: sum(len(cell.file_queue) for cell in self.cells if cell.file_queue is not None))
+            self.metrics.set('queued_files', lambda: sum(cell.archiver.queue_sizes()[0] for cell in self.cells if cell.archiver))
+            self.metrics.set('queued_batches', lambda: sum(cell.archiver.queue_sizes()[1] for cell in self.cells if cell.archiver))
+            self.metrics.set('upload_queue_batches', lambda: self.scp.queue_size() if self.scp else 0)
+            self.metrics.start(json_file=self.metrics_file,
+                               prom_file=os.path.splitext(self.metrics_file)[0] + '.prom' if self.metrics_file else '',
+                               interval=self.metrics_interval, http_port=self.metrics_port, log=self.log)
+            self.scheduler = TransferScheduler(self.export_path, rate_limit=self.upload_rate,
+                                               schedule=self.upload_schedule, channels=self.ssh_channels,
+                                               max_channels=max(self.ssh_channels, self.ssh_max_channels),
+                                               adaptive=self.adaptive_channels, min_free=self.min_free_mb * 1000000,
+                                               metrics=self.metrics, log=self.log)
+            self.scheduler.start()
+            if self.use_journal:
+                self.journal = Journal(os.path.join(self.export_path, self.journal_name), log=self.log)
+            if self.ssh_host:
+                self.scp = SCP(self.ssh_host, self.ssh_user, password=self.ssh_pw, key_file=self.ssh_key,
+                               port=self.ssh_port, remote_path=self.ssh_remote_path,
+                               channels=max(self.ssh_channels, self.ssh_max_channels), verify=self.ssh_verify,
+                               scheduler=self.scheduler, trust_new_host=self.ssh_trust_new_host,
+                               known_hosts=self.ssh_known_hosts, metrics=self.metrics, log=self.log)
+                self.scp.start()
+                self.scp.add_callback(self.on_batch_shipped)
+            archive_workers = self.archive_workers
+            if self.compression:
+                compression_workers = self.compression_workers or os.cpu_count() or 1
+                self.processes = concurrent.futures.ProcessPoolExecutor(compression_workers,
+                                                                        mp_context=multiprocessing.get_context('spawn'),
+                                                                        initializer=FileArchiver.init_process)
+                # archive threads wait for the compression processes, one for each keeps all of them busy
+                archive_workers = max(archive_workers, compression_workers)
+            self.pool = WorkerPool(archive_workers, log=self.log)
+            self.pool.start()
+            for cell in self.flow_cells():
+                self.cells.append(cell)
+                cell.start(self)
             return True
         except Exception as e:
-            self.log.append('[ERROR] Starting watchdog failed')
+            self.log.append('[ERROR] Starting watchdog failed: ' + str(e))
+            try:
+                self.__shutdown__()
+            except Exception as e:
+                self.log.append('[ERROR] Stopping after failed start failed: ' + str(e))
             return False
 
+    # stop all components started so far
+    def __shutdown__(self):
+        # first, archive jobs waiting for disk space give up instead of blocking the stop
+        if self.scheduler:
+            self.scheduler.stop()
+        for cell in self.cells:
+            cell.stop()
+        self.cells = []
+        if self.pool:
+            self.pool.stop()
+            self.pool = None
+        if self.processes:
+            self.processes.shutdown()
+            self.processes = None
+        if self.scp:
+            self.scp.stop(timeout=self.ssh_stop_timeout)
+            self.scp = None
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        self.metrics.stop()
+
     def stop_watchdog(self):
         try:
-            self.observer.stop()
-            self.observer.join()
-            for name in self.file_queue.get(t_wait=0):
-                if os.path.isfile(name):
-                    self.archiver.add(name)
-            self.archiver.stop()
+            self.__shutdown__()
             self.log.append('[INFO] Stopped File System Observer')
             return True
         except Exception as e:
             self.log.append('[ERROR] Stoping Watchdog failed')
             return False
 
-    def on_file_event(self, file_name):
-        self.file_queue.put(file_name)
-        for name in self.file_queue.get(t_wait=self.delay):
-            if os.path.isfile(name):
-                self.archiver.add(name)
-
-
-# Main Window
-class app_window(wx.Frame):
-    def __init__(self, parent, title):
-        # ensure the parent's __init__ is called
-        super(app_window, self).__init__(parent, title=title, size=(520,560), style=wx.CAPTION | wx.MINIMIZE_BOX | 
-                                         wx.CLOSE_BOX | wx.RESIZE_BORDER | wx.CLIP_CHILDREN)
-        # init app class
-        self.log = Log()
-        self.log.add_callback(self.on_log)
-        self.app = app_core(log=self.log)
-        # create a menu bar
-        self.makeMenuBar()
-        self.initUI()
-        self.initEvents()
-        self.Show()
-
-    def makeMenuBar(self):
-        # Make a file menu with Hello and Exit items
-        fileMenu = wx.Menu()
-        # When using a stock ID we don't need to specify the menu item's label
-        exitItem = fileMenu.Append(wx.ID_EXIT)
-        # Now a help menu for the about item
-        helpMenu = wx.Menu()
-        aboutItem = helpMenu.Append(wx.ID_ABOUT)
-        # Main menu bar
-        menuBar = wx.MenuBar()
-        menuBar.Append(fileMenu, "&File")
-        menuBar.Append(helpMenu, "&Help")
-        # Give the menu bar to the frame
-        self.SetMenuBar(menuBar)
-        # Bind event handler
-        self.Bind(wx.EVT_MENU, self.on_exit,  exitItem)
-        self.Bind(wx.EVT_MENU, self.on_about, aboutItem)
-
-    def initUI(self):
-        panel = wx.Panel(self)
-        sizer = wx.GridBagSizer(6, 5)
-        # Destination settings
-        dst_box = wx.StaticBox(panel, label="File System")
-        dst_sizer = wx.StaticBoxSizer(dst_box, wx.VERTICAL)
-        dst_grid = wx.GridBagSizer(3, 5)
-        lbl_Source = wx.StaticText(panel, label="Source")      
-        self.txt_Source = wx.TextCtrl(panel)
-        self.btn_Source = wx.Button(panel, label="Browse...", size=(-1, 20), )
-        lbl_Destination = wx.StaticText(panel, label="Local/ Temp")
-        self.txt_Destination = wx.TextCtrl(panel)    
-        self.btn_Destination = wx.Button(panel, label="Browse...", size=(-1, 20))
-        lbl_ssh_key = wx.StaticText(panel, label="SCP Key")
-        self.txt_ssh_key = wx.TextCtrl(panel)    
-        self.btn_ssh_key = wx.Button(panel, label="Browse...", size=(-1, 20))
-        lbl_ssh_host = wx.StaticText(panel, label="SCP Host")
-        self.txt_ssh_host = wx.TextCtrl(panel)
-        lbl_username = wx.StaticText(panel, label="SCP User")
-        self.txt_ssh_user = wx.TextCtrl(panel)
-        lbl_password = wx.StaticText(panel, label="SCP Password")
-        self.txt_ssh_pw = wx.TextCtrl(panel, style=wx.TE_PASSWORD)
-        dst_grid.Add(lbl_Source, pos=(0,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_Source, pos=(0,1), span=(1, 3), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.btn_Source, pos=(0,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(lbl_Destination, pos=(1,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_Destination, pos=(1,1), span=(1, 3), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.btn_Destination, pos=(1,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(lbl_ssh_host, pos=(2,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_ssh_host, pos=(2,1), span=(1, 1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(lbl_ssh_key, pos=(2,2), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_ssh_key, pos=(2,3), span=(1, 1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.btn_ssh_key, pos=(2,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(lbl_username, pos=(3,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_ssh_user, pos=(3,1), span=(1,1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(lbl_password, pos=(3,2), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.Add(self.txt_ssh_pw, pos=(3,3), span=(1,1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
-        dst_grid.AddGrowableCol(1)
-        dst_grid.AddGrowableCol(3)
-        dst_sizer.Add(dst_grid, flag=wx.EXPAND)
-        sizer.Add(dst_sizer, pos=(0, 0), span=(1, 5), 
-            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
-        # Run params
-        run_box = wx.StaticBox(panel, label="Run")
-        run_sizer = wx.StaticBoxSizer(run_box, wx.VERTICAL)
-        run_grid = wx.GridSizer(3, 4, 5, 5)
-        lbl_cell_id = wx.StaticText(panel, label="Flo-Cell ID")
-        self.txt_cell_id = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.cell_id)
-        lbl_cell_type = wx.StaticText(panel, label="Flo-Cell Type")
-        self.txt_cell_type = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.cell_type)
-        lbl_kit = wx.StaticText(panel, label="Sequencing Kit")
-        self.txt_kit = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.kit)
-        lbl_usr1 = wx.StaticText(panel, label="User Field 1")
-        self.txt_usr1 = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.usr1)
-        lbl_usr2 = wx.StaticText(panel, label="User Field 2")
-        self.txt_usr2 = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.usr2)
-        run_grid.Add(lbl_cell_id, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        run_grid.Add(self.txt_cell_id)
-        run_grid.Add(lbl_usr1, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        run_grid.Add(self.txt_usr1)
-        run_grid.Add(lbl_cell_type, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        run_grid.Add(self.txt_cell_type)
-        run_grid.Add(lbl_usr2, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        run_grid.Add(self.txt_usr2)
-        run_grid.Add(lbl_kit, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        run_grid.Add(self.txt_kit)
-        run_sizer.Add(run_grid, flag=wx.EXPAND)
-        sizer.Add(run_sizer, pos=(1, 0), span=(1, 5), 
-            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
-        # Options
-        opt_box = wx.StaticBox(panel, label="Options")
-        opt_sizer = wx.StaticBoxSizer(opt_box, wx.VERTICAL)
-        opt_grid = wx.GridSizer(4, 4, 5, 5)
-        self.chk_recursive = wx.CheckBox(panel, label="Recursive")
-        self.chk_igexist = wx.CheckBox(panel, label="Ignore Existing")
-        lbl_batch_size = wx.StaticText(panel, label="Batch size")
-        lbl_batch_offset = wx.StaticText(panel, label="Batch offset")
-        lbl_delay = wx.StaticText(panel, label="Delay")
-        self.int_batch_size = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.batch_size)
-        self.int_batch_offset = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.batch_offset)
-        self.int_delay = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.delay)
-        lbl_file_regex = wx.StaticText(panel, label="File regex")
-        lbl_batch_prefix = wx.StaticText(panel, label="Batch prefix")
-        self.txt_file_regex = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.regex)
-        self.txt_batch_prefix = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.batch_prefix)
-        opt_grid.Add(self.chk_recursive, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.chk_igexist, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(wx.StaticText(panel))
-        opt_grid.Add(wx.StaticText(panel))
-        opt_grid.Add(lbl_batch_size, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.int_batch_size, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(lbl_batch_offset, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.int_batch_offset, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(lbl_file_regex, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.txt_file_regex, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(lbl_batch_prefix, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.txt_batch_prefix, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(lbl_delay, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_grid.Add(self.int_delay, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
-        opt_sizer.Add(opt_grid, flag=wx.EXPAND)
-        sizer.Add(opt_sizer, pos=(2, 0), span=(1, 5), 
-            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
-        # Log
-        self.txt_log = wx.TextCtrl(panel, style=wx.TE_MULTILINE)
-        self.txt_log.Disable()
-        sizer.Add(self.txt_log, pos=(3,0), span=(1,5), flag=wx.EXPAND, border=5)
-        # Flow Control
-        self.btn_Start = wx.Button(panel, label="Start")
-        sizer.Add(self.btn_Start, pos=(4, 3))
-        self.btn_Stop = wx.Button(panel, label="Stop")
-        self.btn_Stop.Disable()
-        sizer.Add(self.btn_Stop, pos=(4, 4), span=(1, 1),  
-            flag=wx.BOTTOM|wx.RIGHT, border=5)
-        sizer.AddGrowableCol(2)
-        sizer.AddGrowableRow(3)
-        panel.SetSizer(sizer)
-        self.panel = panel
-
-    def initEvents(self):
-        self.Bind(wx.EVT_CLOSE, self.on_exit)
-        self.Bind(wx.EVT_BUTTON, self.on_source_browse, self.btn_Source)
-        self.Bind(wx.EVT_BUTTON, self.on_destination_browse, self.btn_Destination)
-        self.Bind(wx.EVT_BUTTON, self.on_key_browse, self.btn_ssh_key)
-        self.Bind(wx.EVT_BUTTON, self.on_start_click, self.btn_Start)
-        self.Bind(wx.EVT_BUTTON, self.on_stop_click, self.btn_Stop)
-
-    def on_exit(self, event):
-        self.on_stop_click(None)
-        self.Destroy()
-
-    def on_about(self, event):
-        wx.MessageBox("Export MinION reads in batches to remote location.",
-                      "MinION Export Deamon",
-                      wx.OK|wx.ICON_INFORMATION)     
-
-    def on_log(self, log):
-        wx.CallAfter(self.txt_log.Enable)
-        wx.CallAfter(self.txt_log.AppendText, log)
-        wx.CallAfter(self.txt_log.AppendText, '\n')
-        wx.CallAfter(self.txt_log.Disable)
-
-    def on_source_browse(self, event):
-        dlg = wx.DirDialog (None, "Choose source directory", "",
-                    wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
-        if dlg.ShowModal() == wx.ID_OK:
-            self.txt_Source.SetValue(dlg.GetPath())
-
-    def on_destination_browse(self, event):
-        dlg = wx.DirDialog (None, "Choose destination directory", "",
-                    wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
-        if dlg.ShowModal() == wx.ID_OK:
-            self.txt_Destination.SetValue(dlg.GetPath())
-
-    def on_key_browse(self, event):
-        dlg = wx.FileDialog (None, "Choose private key file",
-                             style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
-        if dlg.ShowModal() == wx.ID_OK:
-            self.txt_ssh_key.SetValue(dlg.GetPath())
-
-    def on_start_click(self, event):
-        self.app.source_path = self.txt_Source.GetValue()
-        self.app.export_path = self.txt_Destination.GetValue()
-        self.app.recursive = self.chk_recursive.GetValue()
-        self.app.ignore_existing = self.chk_igexist.GetValue()
-        self.app.batch_size = self.int_batch_size.GetValue()
-        self.app.batch_offset = self.int_batch_offset.GetValue()
-        self.app.delay = self.int_delay.GetValue()
-        self.app.regex = self.txt_file_regex
-        self.app.batch_prefix = self.txt_batch_prefix.GetValue()
-        if self.app.is_startable():
-            if self.app.start_watchdog():
-                for child in self.panel.GetChildren():
-                    if hasattr(child, 'Disable'):
-                        child.Disable()
-                self.btn_Stop.Enable()
-
-    def on_stop_click(self, event):
-        if self.app.stop_watchdog():
-            for child in self.panel.GetChildren():
-                if hasattr(child, 'Enable'):
-                    child.Enable()
-            self.btn_Stop.Disable()
+    # compact one line summary of the pipeline state
+    def status_line(self):
+        m = self.metrics
+        return ('Pending {:.0f} | Queued {:.0f} files, {:.0f} batches | Archived {:.0f} files, {:.1f} MB/s | '
+                'Upload {:.0f} queued, {:.1f} MB/s | Latency p50 {:.1f} s').format(
+                    m.gauge('pending_files'), m.gauge('queued_files'), m.gauge('queued_batches'),
+                    m.counter('files_archived_total'), m.rate('bytes_archived_total') / 1e6,
+                    m.gauge('upload_queue_batches'), m.rate('bytes_uploaded_total') / 1e6,
+                    m.quantile('event_to_archive_seconds', 0.5))
 
+    # batch is on the remote host, verified if ssh_verify is set
+    def on_batch_shipped(self, tar_file):
+        local_file = os.path.join(self.export_path, os.path.basename(tar_file))
+        if not self.keep_shipped and os.path.isfile(local_file):
+            try:
+                os.remove(local_file)
+            except OSError as e:
+                self.log.append('[ERROR] Removing shipped ' + local_file + ' failed: ' + str(e))
+        if self.journal:
+            self.journal.shipped(tar_file)
+            if self.delete_source:
+                removed = 0
+                for name in self.journal.files(tar_file):
+                    try:
+                        os.remove(name)
+                        removed += 1
+                    except OSError as e:
+                        self.log.append('[ERROR] Removing source ' + name + ' failed: ' + str(e))
+                self.log.append('[INFO] Removed ' + str(removed) + ' source files of verified ' + os.path.basename(tar_file))
 
-if __name__ == '__main__':
+
+# read [nanoscp] settings and [run:CELL_ID] sections, only plain settings of app_core may be set
+def read_config(app, file_name):
+    config = configparser.ConfigParser()
+    with open(file_name, 'r') as fp:
+        config.read_file(fp)
+    if config.has_section('nanoscp'):
+        for key, value in config.items('nanoscp'):
+            default = getattr(app, key, None)
+            if type(default) not in [str, int, float, bool]:
+                raise ValueError('Unknown setting ' + key)
+            if isinstance(default, bool):
+                value = config.getboolean('nanoscp', key)
+            elif isinstance(default, int):
+                value = int(value)
+            elif isinstance(default, float):
+                value = float(value)
+            setattr(app, key, value)
+    for section in config.sections():
+        if not section.startswith('run:'):
+            continue
+        run = {'cell_id': section[len('run:'):]}
+        for key, value in config.items(section):
+            if key not in ['source_path', 'regex', 'batch_prefix', 'batch_offset', 'recursive', 'ignore_existing']:
+                raise ValueError('Unknown run setting ' + key + ' in ' + section)
+            if key in ['recursive', 'ignore_existing']:
+                value = config.getboolean(section, key)
+            elif key == 'batch_offset':
+                value = int(value)
+            run[key] = value
+        app.runs.append(run)
+
+
+# parse command line and config file into app_core attributes
+def parse_args(app, argv=None):
+    parser = argparse.ArgumentParser(description='Package and export MinION fast5 reads to network or remote location')
+    parser.add_argument('--config', help='INI file with a [nanoscp] section of app settings and optional [run:CELL_ID] sections')
+    parser.add_argument('--gui', action='store_true', help='start graphical interface')
+    parser.add_argument('--source', dest='source_path', help='directory to watch')
+    parser.add_argument('--run', action='append', metavar='CELL_ID=SOURCE',
+                        help='watch an additional flow cell directory, may be repeated')
+    parser.add_argument('--export', dest='export_path', help='local/ temp directory for tar batches')
+    parser.add_argument('--prefix', dest='batch_prefix')
+    parser.add_argument('--regex')
+    parser.add_argument('--batch-size', dest='batch_size', type=int)
+    parser.add_argument('--batch-mb', dest='batch_mb', type=int)
+    parser.add_argument('--batch-age', dest='batch_age', type=int)
+    parser.add_argument('--batch-offset', dest='batch_offset', type=int)
+    parser.add_argument('--delay', type=int)
+    parser.add_argument('--workers', dest='archive_workers', type=int)
+    parser.add_argument('--recursive', action='store_const', const=True)
+    parser.add_argument('--ignore-existing', dest='ignore_existing', action='store_const', const=True)
+    parser.add_argument('--polling', action='store_const', const=True)
+    parser.add_argument('--compress', dest='compression', choices=['auto', 'zstd', 'gzip'],
+                        help='compress batches unless samples save less than compression_min_saving')
+    parser.add_argument('--compress-level', dest='compression_level', type=int)
+    parser.add_argument('--compress-workers', dest='compression_workers', type=int, help='compression processes')
+    parser.add_argument('--no-journal', dest='use_journal', action='store_const', const=False)
+    parser.add_argument('--host', help='remote host as host[:path]')
+    parser.add_argument('--port', dest='ssh_port', type=int)
+    parser.add_argument('--user', dest='ssh_user')
+    parser.add_argument('--key', dest='ssh_key')
+    parser.add_argument('--trust-new-host', dest='ssh_trust_new_host', action='store_const', const=True,
+                        help='accept and save the key of a host missing in known_hosts')
+    parser.add_argument('--channels', dest='ssh_channels', type=int)
+    parser.add_argument('--stream', dest='ssh_stream', action='store_const', const=True)
+    parser.add_argument('--verify', dest='ssh_verify', action='store_const', const=True,
+                        help='compare sha256sum of remote batches, requires sha256sum on the host')
+    parser.add_argument('--keep-shipped', dest='keep_shipped', action='store_const', const=True,
+                        help='keep local copies of uploaded batches')
+    parser.add_argument('--delete-source', dest='delete_source', action='store_const', const=True,
+                        help='remove source files of verified batches')
+    parser.add_argument('--upload-rate', dest='upload_rate', type=float, help='upload limit in MB/s')
+    parser.add_argument('--upload-schedule', dest='upload_schedule',
+                        help="upload limits by time of day, e.g. '08:00-20:00=20;20:00-08:00=0' in MB/s")
+    parser.add_argument('--max-channels', dest='ssh_max_channels', type=int)
+    parser.add_argument('--min-free-mb', dest='min_free_mb', type=int, help='pause archiving below free space')
+    parser.add_argument('--metrics-file', dest='metrics_file', help='JSON metrics file, Prometheus text is written next to it')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, help='serve metrics on localhost port')
+    args = parser.parse_args(argv)
+    # the window starts with its own settings
+    if args.gui and any(value is not None for key, value in vars(args).items() if key != 'gui'):
+        parser.error('--gui takes no settings, enter them in the window')
+    if args.config:
+        try:
+            read_config(app, args.config)
+        except (OSError, ValueError, configparser.Error) as e:
+            parser.error('--config ' + args.config + ': ' + str(e))
+    for key, value in vars(args).items():
+        if key in ['config', 'gui', 'host', 'run'] or value is None:
+            continue
+        setattr(app, key, value)
+    for run in args.run or []:
+        cell_id, _, source_path = run.partition('=')
+        if not cell_id or not source_path:
+            parser.error('--run expects CELL_ID=SOURCE')
+        app.runs.append({'cell_id': cell_id, 'source_path': source_path})
+    if args.host:
+        app.ssh_host, _, app.ssh_remote_path = args.host.partition(':')
+    if not app.ssh_pw:
+        app.ssh_pw = os.environ.get('NANOSCP_PASSWORD', '')
+    return args
+
+
+# run without GUI until SIGTERM/ SIGINT
+def run_headless(app):
+    if not app.is_startable() or not app.start_watchdog():
+        return 1
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    while not stop_event.wait(1):
+        pass
+    app.log.append('[INFO] Received stop signal, writing remaining files')
+    return 0 if app.stop_watchdog() else 1
+
+
+def run_gui():
+    import wx
+    from nanoscp_gui import app_window
     app = wx.App()
     app_main = app_window(None, title='NanoSCP')
     app.MainLoop()
-    exit()
\ No newline at end of file
+    return 0
+
+
+def main(argv=None):
+    log = Log()
+    log.add_callback(lambda message: print(message, flush=True))
+    app = app_core(log=log)
+    args = parse_args(app, argv)
+    if args.gui or not (args.config or args.source_path or args.run):
+        return run_gui()
+    return run_headless(app)
+
+
+if __name__ == '__main__':
+    # compression processes of frozen Windows executables must not start the app again
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#! python
+import wx
+import wx.lib
+from wx.lib import intctrl
+from nanoscp import Log, app_core
+
+
+# Main Window
+class app_window(wx.Frame):
+    def __init__(self, parent, title):
+        # ensure the parent's __init__ is called
+        super(app_window, self).__init__(parent, title=title, size=(520,560), style=wx.CAPTION | wx.MINIMIZE_BOX | 
+                                         wx.CLOSE_BOX | wx.RESIZE_BORDER | wx.CLIP_CHILDREN)
+        # init app class
+        self.log = Log()
+        self.log_seq = 0
+        self.log_interval = 250
+        self.log_max_lines = 2000
+        self.status_interval = 1000
+        self.app = app_core(log=self.log)
+        # create a menu bar
+        self.makeMenuBar()
+        self.initUI()
+        self.initEvents()
+        self.Show()
+
+    def makeMenuBar(self):
+        # Make a file menu with Hello and Exit items
+        fileMenu = wx.Menu()
+        # When using a stock ID we don't need to specify the menu item's label
+        exitItem = fileMenu.Append(wx.ID_EXIT)
+        # Now a help menu for the about item
+        helpMenu = wx.Menu()
+        aboutItem = helpMenu.Append(wx.ID_ABOUT)
+        # Main menu bar
+        menuBar = wx.MenuBar()
+        menuBar.Append(fileMenu, "&File")
+        menuBar.Append(helpMenu, "&Help")
+        # Give the menu bar to the frame
+        self.SetMenuBar(menuBar)
+        # Bind event handler
+        self.Bind(wx.EVT_MENU, self.on_exit,  exitItem)
+        self.Bind(wx.EVT_MENU, self.on_about, aboutItem)
+
+    def initUI(self):
+        panel = wx.Panel(self)
+        sizer = wx.GridBagSizer(6, 5)
+        # Destination settings
+        dst_box = wx.StaticBox(panel, label="File System")
+        dst_sizer = wx.StaticBoxSizer(dst_box, wx.VERTICAL)
+        dst_grid = wx.GridBagSizer(3, 5)
+        lbl_Source = wx.StaticText(panel, label="Source")      
+        self.txt_Source = wx.TextCtrl(panel)
+        self.btn_Source = wx.Button(panel, label="Browse...", size=(-1, 20), )
+        lbl_Destination = wx.StaticText(panel, label="Local/ Temp")
+        self.txt_Destination = wx.TextCtrl(panel)    
+        self.btn_Destination = wx.Button(panel, label="Browse...", size=(-1, 20))
+        lbl_ssh_key = wx.StaticText(panel, label="SCP Key")
+        self.txt_ssh_key = wx.TextCtrl(panel)    
+        self.btn_ssh_key = wx.Button(panel, label="Browse...", size=(-1, 20))
+        lbl_ssh_host = wx.StaticText(panel, label="SCP Host")
+        self.txt_ssh_host = wx.TextCtrl(panel)
+        lbl_username = wx.StaticText(panel, label="SCP User")
+        self.txt_ssh_user = wx.TextCtrl(panel)
+        lbl_password = wx.StaticText(panel, label="SCP Password")
+        self.txt_ssh_pw = wx.TextCtrl(panel, style=wx.TE_PASSWORD)
+        dst_grid.Add(lbl_Source, pos=(0,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_Source, pos=(0,1), span=(1, 3), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.btn_Source, pos=(0,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(lbl_Destination, pos=(1,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_Destination, pos=(1,1), span=(1, 3), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.btn_Destination, pos=(1,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(lbl_ssh_host, pos=(2,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_ssh_host, pos=(2,1), span=(1, 1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(lbl_ssh_key, pos=(2,2), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_ssh_key, pos=(2,3), span=(1, 1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.btn_ssh_key, pos=(2,4), flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(lbl_username, pos=(3,0), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_ssh_user, pos=(3,1), span=(1,1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(lbl_password, pos=(3,2), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.Add(self.txt_ssh_pw, pos=(3,3), span=(1,1), flag=wx.EXPAND|wx.ALIGN_CENTER_VERTICAL, border=5)
+        dst_grid.AddGrowableCol(1)
+        dst_grid.AddGrowableCol(3)
+        dst_sizer.Add(dst_grid, flag=wx.EXPAND)
+        sizer.Add(dst_sizer, pos=(0, 0), span=(1, 5), 
+            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
+        # Run params
+        run_box = wx.StaticBox(panel, label="Run")
+        run_sizer = wx.StaticBoxSizer(run_box, wx.VERTICAL)
+        run_grid = wx.GridSizer(3, 4, 5, 5)
+        lbl_cell_id = wx.StaticText(panel, label="Flo-Cell ID")
+        self.txt_cell_id = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.cell_id)
+        lbl_cell_type = wx.StaticText(panel, label="Flo-Cell Type")
+        self.txt_cell_type = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.cell_type)
+        lbl_kit = wx.StaticText(panel, label="Sequencing Kit")
+        self.txt_kit = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.kit)
+        lbl_usr1 = wx.StaticText(panel, label="User Field 1")
+        self.txt_usr1 = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.usr1)
+        lbl_usr2 = wx.StaticText(panel, label="User Field 2")
+        self.txt_usr2 = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.usr2)
+        run_grid.Add(lbl_cell_id, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        run_grid.Add(self.txt_cell_id)
+        run_grid.Add(lbl_usr1, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        run_grid.Add(self.txt_usr1)
+        run_grid.Add(lbl_cell_type, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        run_grid.Add(self.txt_cell_type)
+        run_grid.Add(lbl_usr2, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        run_grid.Add(self.txt_usr2)
+        run_grid.Add(lbl_kit, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        run_grid.Add(self.txt_kit)
+        run_sizer.Add(run_grid, flag=wx.EXPAND)
+        sizer.Add(run_sizer, pos=(1, 0), span=(1, 5), 
+            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
+        # Options
+        opt_box = wx.StaticBox(panel, label="Options")
+        opt_sizer = wx.StaticBoxSizer(opt_box, wx.VERTICAL)
+        opt_grid = wx.GridSizer(5, 4, 5, 5)
+        self.chk_recursive = wx.CheckBox(panel, label="Recursive")
+        self.chk_igexist = wx.CheckBox(panel, label="Ignore Existing")
+        self.chk_stream = wx.CheckBox(panel, label="Stream to Host")
+        self.chk_polling = wx.CheckBox(panel, label="Poll Share")
+        self.chk_trust_host = wx.CheckBox(panel, label="Trust New Host")
+        lbl_batch_size = wx.StaticText(panel, label="Batch size")
+        lbl_batch_offset = wx.StaticText(panel, label="Batch offset")
+        lbl_delay = wx.StaticText(panel, label="Delay")
+        lbl_batch_mb = wx.StaticText(panel, label="Batch MB")
+        lbl_batch_age = wx.StaticText(panel, label="Batch max. age")
+        self.int_batch_size = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.batch_size)
+        self.int_batch_offset = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.batch_offset)
+        self.int_delay = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.delay)
+        self.int_batch_mb = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.batch_mb)
+        self.int_batch_age = intctrl.IntCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.batch_age)
+        lbl_file_regex = wx.StaticText(panel, label="File regex")
+        lbl_batch_prefix = wx.StaticText(panel, label="Batch prefix")
+        self.txt_file_regex = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(80, -1), value=self.app.regex)
+        self.txt_batch_prefix = wx.TextCtrl(panel, style=wx.TE_RIGHT, size=(60, -1), value=self.app.batch_prefix)
+        opt_grid.Add(self.chk_recursive, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.chk_igexist, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.chk_stream, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.chk_polling, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_batch_size, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.int_batch_size, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_batch_offset, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.int_batch_offset, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_file_regex, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.txt_file_regex, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_batch_prefix, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.txt_batch_prefix, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_delay, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.int_delay, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_batch_mb, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.int_batch_mb, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(lbl_batch_age, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.int_batch_age, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_grid.Add(self.chk_trust_host, flag=wx.ALIGN_CENTER_VERTICAL, border=5)
+        opt_sizer.Add(opt_grid, flag=wx.EXPAND)
+        sizer.Add(opt_sizer, pos=(2, 0), span=(1, 5), 
+            flag=wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT , border=0)
+        # Log
+        self.txt_log = wx.TextCtrl(panel, style=wx.TE_MULTILINE)
+        self.txt_log.Disable()
+        sizer.Add(self.txt_log, pos=(3,0), span=(1,5), flag=wx.EXPAND, border=5)
+        # Status
+        self.lbl_status = wx.StaticText(panel, label='')
+        sizer.Add(self.lbl_status, pos=(4, 0), span=(1, 3), flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL, border=5)
+        # Flow Control
+        self.btn_Start = wx.Button(panel, label="Start")
+        sizer.Add(self.btn_Start, pos=(4, 3))
+        self.btn_Stop = wx.Button(panel, label="Stop")
+        self.btn_Stop.Disable()
+        sizer.Add(self.btn_Stop, pos=(4, 4), span=(1, 1),  
+            flag=wx.BOTTOM|wx.RIGHT, border=5)
+        sizer.AddGrowableCol(2)
+        sizer.AddGrowableRow(3)
+        panel.SetSizer(sizer)
+        self.panel = panel
+
+    def initEvents(self):
+        self.log_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_log, self.log_timer)
+        self.log_timer.Start(self.log_interval)
+        self.status_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_status, self.status_timer)
+        self.Bind(wx.EVT_CLOSE, self.on_exit)
+        self.Bind(wx.EVT_BUTTON, self.on_source_browse, self.btn_Source)
+        self.Bind(wx.EVT_BUTTON, self.on_destination_browse, self.btn_Destination)
+        self.Bind(wx.EVT_BUTTON, self.on_key_browse, self.btn_ssh_key)
+        self.Bind(wx.EVT_BUTTON, self.on_start_click, self.btn_Start)
+        self.Bind(wx.EVT_BUTTON, self.on_stop_click, self.btn_Stop)
+
+    def on_exit(self, event):
+        self.on_stop_click(None)
+        self.log_timer.Stop()
+        self.status_timer.Stop()
+        self.Destroy()
+
+    def on_about(self, event):
+        wx.MessageBox("Export MinION reads in batches to remote location.",
+                      "MinION Export Deamon",
+                      wx.OK|wx.ICON_INFORMATION)     
+
+    # append new log entries in one update, keep at most log_max_lines
+    def on_log(self, event):
+        entries = self.log.entries(self.log_seq)
+        if not entries:
+            return
+        lines = [Log.format(entry) for entry in entries[-self.log_max_lines:]]
+        skipped = entries[0][0] - self.log_seq - 1 + len(entries) - len(lines)
+        if skipped > 0:
+            lines.insert(0, '... ' + str(skipped) + ' messages skipped')
+        self.log_seq = entries[-1][0]
+        self.txt_log.Freeze()
+        self.txt_log.Enable()
+        self.txt_log.AppendText('\n'.join(lines) + '\n')
+        excess = self.txt_log.GetNumberOfLines() - self.log_max_lines
+        if excess > 0:
+            self.txt_log.Remove(0, self.txt_log.XYToPosition(0, excess))
+        self.txt_log.Disable()
+        self.txt_log.Thaw()
+
+    def on_status(self, event):
+        self.lbl_status.SetLabel(self.app.status_line())
+
+    def on_source_browse(self, event):
+        dlg = wx.DirDialog (None, "Choose source directory", "",
+                    wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.txt_Source.SetValue(dlg.GetPath())
+
+    def on_destination_browse(self, event):
+        dlg = wx.DirDialog (None, "Choose destination directory", "",
+                    wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.txt_Destination.SetValue(dlg.GetPath())
+
+    def on_key_browse(self, event):
+        dlg = wx.FileDialog (None, "Choose private key file",
+                             style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.txt_ssh_key.SetValue(dlg.GetPath())
+
+    def on_start_click(self, event):
+        self.app.source_path = self.txt_Source.GetValue()
+        self.app.export_path = self.txt_Destination.GetValue()
+        self.app.recursive = self.chk_recursive.GetValue()
+        self.app.ignore_existing = self.chk_igexist.GetValue()
+        self.app.ssh_stream = self.chk_stream.GetValue()
+        self.app.polling = self.chk_polling.GetValue()
+        self.app.ssh_trust_new_host = self.chk_trust_host.GetValue()
+        self.app.batch_size = self.int_batch_size.GetValue()
+        self.app.batch_offset = self.int_batch_offset.GetValue()
+        self.app.batch_mb = self.int_batch_mb.GetValue()
+        self.app.batch_age = self.int_batch_age.GetValue()
+        self.app.delay = self.int_delay.GetValue()
+        self.app.regex = self.txt_file_regex.GetValue()
+        self.app.batch_prefix = self.txt_batch_prefix.GetValue()
+        self.app.ssh_host, _, self.app.ssh_remote_path = self.txt_ssh_host.GetValue().partition(':')
+        self.app.ssh_user = self.txt_ssh_user.GetValue()
+        self.app.ssh_pw = self.txt_ssh_pw.GetValue()
+        self.app.ssh_key = self.txt_ssh_key.GetValue()
+        if self.app.is_startable():
+            if self.app.start_watchdog():
+                for child in self.panel.GetChildren():
+                    if hasattr(child, 'Disable'):
+                        child.Disable()
+                self.btn_Stop.Enable()
+                self.status_timer.Start(self.status_interval)
+
+    def on_stop_click(self, event):
+        self.status_timer.Stop()
+        if self.app.stop_watchdog():
+            for child in self.panel.GetChildren():
+                if hasattr(child, 'Enable'):
+                    child.Enable()
+            self.btn_Stop.Disable()
+
+
+if __name__ == '__main__':
+    app = wx.App()
+    app_main = app_window(None, title='NanoSCP')
+    app.MainLoop()
+    exit()
@@ -0,0 +1,320 @@
+#! python
+import os, sys, time
+import threading
+import hashlib
+import shutil, tempfile
+import subprocess, signal
+import tarfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark'))
+from nanoscp import Log, Metrics, TimedSet, Journal, FileArchiver, TransferScheduler, SCP, app_core
+from nanoscp_bench import SFTPStandIn
+
+
+# files in tmp with mtime a day back, they are archived without settling
+def make_reads(path, n, size):
+    os.makedirs(path, exist_ok=True)
+    t_old = time.time() - 86400
+    files = []
+    for i in range(n):
+        file_name = os.path.join(path, 'read_{:04d}.fast5'.format(i))
+        with open(file_name, 'wb') as fp:
+            fp.write(os.urandom(size))
+        os.utime(file_name, (t_old, t_old))
+        files.append(file_name)
+    return files
+
+
+class TimedSetTest(unittest.TestCase):
+    def test_release(self):
+        released = []
+        timed_set = TimedSet(delay=0.5, notify=lambda item, t_touch: released.append(item))
+        timed_set.start()
+        try:
+            timed_set.put('a')
+            time.sleep(0.3)
+            # touching restarts the delay
+            timed_set.put('a')
+            timed_set.put('b')
+            time.sleep(0.35)
+            self.assertEqual(released, [])
+            t_end = time.time() + 5
+            while len(released) < 2 and time.time() < t_end:
+                time.sleep(0.05)
+            self.assertEqual(sorted(released), ['a', 'b'])
+            self.assertEqual(len(timed_set), 0)
+        finally:
+            timed_set.stop()
+
+    def test_stop_keeps_items(self):
+        timed_set = TimedSet(delay=60)
+        timed_set.start()
+        timed_set.put('a')
+        t_start = time.time()
+        timed_set.stop()
+        self.assertLess(time.time() - t_start, 5)
+        self.assertEqual(timed_set.get(), ['a'])
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    # a killed run leaves the journal open, the next run sees its pending files and unshipped batches
+    def test_resume_after_kill(self):
+        files = make_reads(os.path.join(self.tmp, 'source'), 3, 100)
+        db_file = os.path.join(self.tmp, 'journal.sqlite')
+        journal = Journal(db_file, commit_interval=1)
+        for f in files:
+            self.assertTrue(journal.queued(f, 'b'))
+        journal.archived('b', 0, 'b0.tar', files[:2])
+        resumed = Journal(db_file)
+        try:
+            self.assertEqual(resumed.pending('b'), files[2:])
+            self.assertEqual(resumed.unshipped('b'), ['b0.tar'])
+            self.assertEqual(resumed.next_batch('b'), 1)
+            self.assertFalse(resumed.queued(files[0], 'b'))
+            # changed since journaled
+            with open(files[2], 'ab') as fp:
+                fp.write(b'more')
+            self.assertTrue(resumed.queued(files[2], 'b'))
+            resumed.shipped('b0.tar')
+            self.assertEqual(resumed.unshipped('b'), [])
+            self.assertEqual(resumed.files('b0.tar'), files[:2])
+        finally:
+            resumed.close()
+            journal.close()
+
+
+class FileArchiverTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dst_path = os.path.join(self.tmp, 'export')
+        os.makedirs(self.dst_path)
+        self.archived = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make_archiver(self, **kwargs):
+        archiver = FileArchiver(self.dst_path, 'b', log=Log(), **kwargs)
+        archiver.add_callback(self.archived.append)
+        return archiver
+
+    def test_recover_partial_files(self):
+        for name in ['b0.tar', 'b0.tar.manifest', 'b1.tar.gz', 'b1.tar.gz.manifest', 'b2.tar.part',
+                     'b2.tar.manifest.part', 'b3.tar.gz.part', 'other.tar.part']:
+            open(os.path.join(self.dst_path, name), 'wb').close()
+        archiver = self.make_archiver(batch_size=1)
+        archiver.start()
+        # collision with a batch written by someone else while running
+        open(os.path.join(self.dst_path, 'b3.tar'), 'wb').close()
+        for f in make_reads(os.path.join(self.tmp, 'source'), 2, 100):
+            archiver.add(f)
+        archiver.stop()
+        self.assertEqual([os.path.basename(f) for f in self.archived], ['b2.tar', 'b4.tar'])
+        self.assertEqual(sorted(os.listdir(self.dst_path)),
+                         ['b0.tar', 'b0.tar.manifest', 'b1.tar.gz', 'b1.tar.gz.manifest', 'b2.tar', 'b2.tar.manifest',
+                          'b3.tar', 'b4.tar', 'b4.tar.manifest', 'other.tar.part'])
+
+    # later small batches finish first, they are reported after the large first one
+    def test_in_order_reporting(self):
+        source_path = os.path.join(self.tmp, 'source')
+        files = make_reads(source_path, 1, 50000000) + make_reads(os.path.join(source_path, 'small'), 7, 100)
+        archiver = self.make_archiver(batch_size=1, workers=4)
+        archiver.start()
+        for f in files:
+            archiver.add(f)
+        archiver.stop()
+        self.assertEqual([os.path.basename(f) for f in self.archived], ['b' + str(i) + '.tar' for i in range(8)])
+        for i, f in enumerate(files):
+            with tarfile.open(os.path.join(self.dst_path, 'b' + str(i) + '.tar')) as tar:
+                self.assertEqual(tar.getnames(), [os.path.basename(f)])
+
+
+# a run killed while archiving is continued from the journal, every file ends up in exactly one tar
+class RestartTest(unittest.TestCase):
+    CHILD = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from nanoscp import app_core
+app = app_core()
+app.source_path, app.export_path = sys.argv[2], sys.argv[3]
+app.batch_size, app.archive_workers, app.delay, app.min_free_mb = 10, 1, 1, 0
+app.start_watchdog()
+time.sleep(60)
+'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make_app(self, source_path, export_path):
+        app = app_core(log=Log())
+        app.source_path, app.export_path = source_path, export_path
+        app.batch_size, app.delay, app.min_free_mb = 10, 1, 0
+        return app
+
+    def test_every_file_in_one_tar(self):
+        source_path, export_path = os.path.join(self.tmp, 'source'), os.path.join(self.tmp, 'export')
+        os.makedirs(export_path)
+        files = make_reads(source_path, 30, 3000000)
+        child = subprocess.Popen([sys.executable, '-c', RestartTest.CHILD, os.path.dirname(os.path.abspath(__file__)),
+                                  source_path, export_path])
+        try:
+            t_end = time.time() + 60
+            while not os.path.isfile(os.path.join(export_path, '0.tar')) and time.time() < t_end:
+                time.sleep(0.005)
+            time.sleep(0.05)
+        finally:
+            os.kill(child.pid, signal.SIGKILL)
+            child.wait()
+        self.assertTrue(os.path.isfile(os.path.join(export_path, '0.tar')))
+        app = self.make_app(source_path, export_path)
+        self.assertTrue(app.start_watchdog())
+        app.stop_watchdog()
+        names = []
+        for name in sorted(os.listdir(export_path)):
+            self.assertFalse(name.endswith('.part'))
+            if name.endswith('.tar'):
+                with tarfile.open(os.path.join(export_path, name)) as tar:
+                    names += tar.getnames()
+        self.assertEqual(sorted(names), sorted(os.path.basename(f) for f in files))
+
+
+# Uploads against the local paramiko SFTP stand-in of the benchmark
+class SCPTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.tmp, 'local')
+        self.remote_path = os.path.join(self.tmp, 'remote')
+        os.makedirs(self.local_path)
+        os.makedirs(self.remote_path)
+        self.server = SFTPStandIn(self.remote_path)
+        self.metrics = Metrics()
+        self.shipped = []
+        self.done = threading.Event()
+        self.scp = None
+
+    def tearDown(self):
+        if self.scp:
+            self.scp.stop()
+        self.server.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def start_scp(self, **kwargs):
+        self.scp = SCP('127.0.0.1', 'test', password='test', port=self.server.port, remote_path='/',
+                       trust_new_host=True, known_hosts=os.path.join(self.tmp, 'known_hosts'),
+                       metrics=self.metrics, log=Log(), **kwargs)
+        self.scp.add_callback(self.on_shipped)
+        self.scp.start()
+        return self.scp
+
+    def on_shipped(self, file_name):
+        self.shipped.append(file_name)
+        self.done.set()
+
+    # local batch with manifest, checksum may be replaced to fail verification
+    def make_batch(self, name, size, checksum=None):
+        data = os.urandom(size)
+        tar_file = os.path.join(self.local_path, name)
+        with open(tar_file, 'wb') as fp:
+            fp.write(data)
+        with open(tar_file + '.manifest', 'wb') as fp:
+            FileArchiver.write_manifest(fp, name, size, checksum or hashlib.sha256(data).hexdigest(), [])
+        return tar_file, data
+
+    def remote_data(self, name):
+        with open(os.path.join(self.remote_path, name), 'rb') as fp:
+            return fp.read()
+
+    def test_upload(self):
+        tar_file, data = self.make_batch('0.tar', 1000000)
+        self.start_scp().put(tar_file)
+        self.assertTrue(self.done.wait(30))
+        self.assertEqual(self.shipped, [tar_file])
+        self.assertEqual(self.remote_data('0.tar'), data)
+        self.assertTrue(os.path.isfile(os.path.join(self.remote_path, '0.tar.manifest')))
+        self.assertEqual(sorted(os.listdir(self.remote_path)), ['0.tar', '0.tar.manifest'])
+        self.assertEqual(self.metrics.counter('bytes_uploaded_total'), 1000000)
+
+    def test_resume_partial_file(self):
+        tar_file, data = self.make_batch('0.tar', 1000000)
+        with open(os.path.join(self.remote_path, '0.tar.part'), 'wb') as fp:
+            fp.write(data[:400000])
+        self.start_scp().put(tar_file)
+        self.assertTrue(self.done.wait(30))
+        self.assertEqual(self.remote_data('0.tar'), data)
+        self.assertEqual(self.metrics.counter('bytes_resumed_total'), 400000)
+        self.assertEqual(self.metrics.counter('bytes_uploaded_total'), 600000)
+
+    def test_resume_after_reconnect(self):
+        tar_file, data = self.make_batch('0.tar', 4000000)
+        scheduler = TransferScheduler(self.local_path, rate_limit=4, adaptive=False, metrics=self.metrics)
+        scp = self.start_scp(retry_delay=0.1, scheduler=scheduler)
+        scp.chunk_size = 256 * 1024
+        scp.put(tar_file)
+        # drop the transport while the upload is throttled halfway
+        time.sleep(0.5)
+        scp.close()
+        self.assertTrue(self.done.wait(30))
+        self.assertEqual(self.remote_data('0.tar'), data)
+        self.assertGreaterEqual(self.metrics.counter('upload_retries_total'), 1)
+        self.assertGreater(self.metrics.counter('bytes_resumed_total'), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.remote_path, '0.tar.part')))
+
+    @unittest.skipIf(shutil.which('sha256sum') is None, 'sha256sum not available')
+    def test_verify(self):
+        tar_file, data = self.make_batch('0.tar', 100000)
+        bad_file, _ = self.make_batch('1.tar', 100000, checksum='0' * 64)
+        scp = self.start_scp(verify=True, retry_delay=30)
+        scp.put(tar_file)
+        scp.put(bad_file)
+        self.assertTrue(self.done.wait(30))
+        t_end = time.time() + 30
+        while not self.metrics.counter('upload_errors_total') and time.time() < t_end:
+            time.sleep(0.05)
+        self.assertEqual(self.shipped, [tar_file])
+        self.assertEqual(self.remote_data('0.tar'), data)
+        self.assertEqual(self.metrics.counter('upload_errors_total'), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.remote_path, '1.tar')))
+        self.assertFalse(os.path.exists(os.path.join(self.remote_path, '1.tar.part')))
+
+    def test_existing_remote_not_overwritten(self):
+        tar_file, data = self.make_batch('0.tar', 100000)
+        with open(os.path.join(self.remote_path, '0.tar'), 'wb') as fp:
+            fp.write(b'other batch')
+        self.start_scp().put(tar_file)
+        t_end = time.time() + 30
+        while not self.metrics.counter('upload_errors_total') and time.time() < t_end:
+            time.sleep(0.05)
+        self.assertEqual(self.metrics.counter('upload_errors_total'), 1)
+        self.assertEqual(self.shipped, [])
+        self.assertEqual(self.remote_data('0.tar'), b'other batch')
+        self.assertTrue(os.path.isfile(tar_file))
+
+    def test_uploaded_before_restart(self):
+        tar_file, data = self.make_batch('0.tar', 100000)
+        with open(os.path.join(self.remote_path, '0.tar'), 'wb') as fp:
+            fp.write(data)
+        self.start_scp().put(tar_file)
+        self.assertTrue(self.done.wait(30))
+        self.assertEqual(self.shipped, [tar_file])
+        self.assertEqual(self.metrics.counter('bytes_uploaded_total'), 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.remote_path, '0.tar.manifest')))
+
+    def test_unknown_host_rejected(self):
+        scp = SCP('127.0.0.1', 'test', password='test', port=self.server.port,
+                  known_hosts=os.path.join(self.tmp, 'known_hosts'), log=Log())
+        with self.assertRaises(Exception):
+            scp.connect()
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'known_hosts')))
+
+
+if __name__ == '__main__':
+    unittest.main()